@@ -15,13 +15,20 @@
 #
 # For a full copy of the GNU General Public License see the doc/GPL.txt file.
 # Common system tools
+import os
+import re
 import logging
 
+# standby instances run here, away from the focused display user plays on
+STANDBY_DISPLAY = 'virtual'
+
 class App:
 
-    def __init__(self, config, app, connections, path_data, opendsp):
+    def __init__(self, config, app, connections, path_data, opendsp, app_id=None):
         # OpenDSP Core instance
         self.opendsp = opendsp
+        # unique name for supervision
+        self.name = "{app_id}:{name}".format(app_id=app_id, name=app.get('name', ''))
         # config are all the user setup inside [appX]
         self.config = config
         # app are the main data structure config of the running app
@@ -31,45 +38,123 @@ class App:
         self.path_data = path_data
         # the state connections keeped by this app
         self.connections = connections
-        self.connections_pending = connections
+        # called once the app is ready after each start
+        self.on_ready = None
+        # warm standby instance with the next project loaded
+        self.standby = None
 
-    def stop(self):
+    def stop(self, stop_proc=True):
+        # no more restarts, we are going away
+        self.opendsp.supervisor.cancel(self.name)
+        self.clear_ready()
+        self.retire_standby()
         # disconnect all jack ports
-        self.opendsp.jackd.disconnect(self.connections)
-        # kill the app process and clear object state
-        self.opendsp.stop_proc(self.data['proc'])
+        self.opendsp.jackd.reconciler.remove(self.name)
+        # kill the app process and clear object state,
+        # unless our owner is going to stop it along with others
+        if 'proc' in self.data and stop_proc:
+            self.opendsp.stop_proc(self.data['proc'])
         del self.data
         self.data = {}
 
-    def start(self):
+    def restart(self):
+        """Restart
+        called by supervisor after a crash, connections are resolved
+        again as soon as the new process register its ports and the
+        realtime schema is applied by the process watcher
+        """
+        # crashed instance readiness must not leak into the new one
+        self.clear_ready()
+        self.data = {}
+        self.start()
+
+    def get_call(self, project=None):
         # setup cmd call and arguments
         call = self.app['bin'].split(" ")
         # ecosystem defined args
         if 'args' in self.app:
             call.extend([arg.replace("<path>", self.path_data) for arg in self.app['args'].split(" ")])
         # project load parameter
-        if 'project' in self.config:
-            if len(self.config['project']) > 0:
-                project_arg = "<prj>"
-                path_project = [path
-                                for path in self.config.get('path', "").split("/")
-                                if path != '']
-                project = "{data}/{path}/{project}".format(data=self.path_data,
-                                                           path="/".join(path_project),
-                                                           project=self.config['project']).strip()
-                if 'project_arg' in self.app:
-                    project_arg = self.app['project_arg']
-                call.extend([prj.replace("<prj>", project)
-                             for prj in project_arg.split(" ")])
+        if project is None:
+            project = self.config.get('project', '')
+        if len(project) > 0:
+            project_arg = "<prj>"
+            path_project = [path
+                            for path in self.config.get('path', "").split("/")
+                            if path != '']
+            project = "{data}/{path}/{project}".format(data=self.path_data,
+                                                       path="/".join(path_project),
+                                                       project=project).strip()
+            if 'project_arg' in self.app:
+                project_arg = self.app['project_arg']
+            call.extend([prj.replace("<prj>", project)
+                         for prj in project_arg.split(" ")])
         # mod defined args
         if 'args' in self.config:
             call.extend(self.config['args'].split(" "))
+        return call
 
-        # where are we going to run this app?
-        if 'display' in self.config:
-            self.data['proc'] = self.opendsp.start_proc(call, self.config['display'])
+    def get_signature(self):
+        """Get Signature
+        two apps with the same signature runs the very same process
+        """
+        return (self.name,
+                tuple(self.get_call()),
+                self.opendsp.get_display(self.config.get('display')),
+                self.config.get('cpu'))
+
+    def get_display(self):
+        """Get Display
+        display our running instance is on, a swapped standby stays on
+        STANDBY_DISPLAY until next start
+        """
+        if 'display' in self.data:
+            return self.data['display']
+        return self.opendsp.get_display(self.config.get('display'))
+
+    def is_running(self):
+        return 'proc' in self.data and self.data['proc'].poll() is None
+
+    def adopt(self, other):
+        """Adopt
+        take over config and connections of a new mod App with our
+        signature, the running process stays untouched
+        """
+        self.config = other.config
+        self.app = other.app
+        self.path_data = other.path_data
+        self.connections = other.connections
+        # rewire only the edges that changed
+        self.opendsp.jackd.reconciler.update(self.name, self.connections, self.get_cache_key(self.get_call()))
+
+    def start(self):
+        """Start
+        non blocking, we are launched as soon as our display is ready
+        """
+        token = object()
+        self.data = {'starting': token}
+        display = self.opendsp.get_display(self.config.get('display'))
+        if display is not None:
+            self.opendsp.display.when_ready(display, self.launch, token)
         else:
-            self.data['proc'] = self.opendsp.start_proc(call)
+            self.launch(token)
+
+    def launch(self, token):
+        # stopped or started again while waiting for display?
+        if self.data.get('starting') is not token:
+            return
+        call = self.get_call()
+
+        # where are we going to run this app?
+        self.data = {}
+        self.data['proc'] = self.opendsp.start_proc(call, self.config.get('display'))
+        self.data['display'] = self.opendsp.get_display(self.config.get('display'))
+
+        # our desired jack connections, made as soon as both ends exist
+        self.opendsp.jackd.reconciler.set(self.name, self.connections, self.get_cache_key(call))
+
+        # restart it on crash following ecosystem policy
+        self.opendsp.supervisor.watch(self.data['proc'], self.name, self.restart, self.get_policy())
 
         # set limits?
         if 'limits' in self.app:
@@ -83,6 +168,10 @@ class App:
         if 'realtime' in self.app and 'realtime' in self.opendsp.config['system']['system']:
             self.opendsp.set_realtime(self.app.get('rt_process', self.app['bin']), int(self.app['realtime']))
 
+        # realtime only for some threads of the app?
+        if 'rt_thread' in self.app:
+            self.opendsp.set_rt_threads(self.app.get('rt_process', self.app['bin']), self.app['rt_thread'])
+
         # generate a list from, parsed by ','
         if 'audio_input' in self.app:
             self.data['audio_input'] = [audio_input.strip()
@@ -97,6 +186,91 @@ class App:
             self.data['midi_output'] = [midi_output.strip()
                                         for midi_output in self.app['midi_output'].split(",")]
 
+        # watch for readiness: jack ports registered and/or window mapped
+        self.data['ready'] = False
+        self.data['ready_wait'] = self.get_ready_checks()
+        timeout = float(self.config.get('ready_timeout', self.app.get('ready_timeout', 10)))
+        self.data['ready_timer'] = self.opendsp.loop.call_later(timeout, self.ready_timeout)
+        self.check_ready()
+
+    def get_cache_key(self, call):
+        """Get Cache Key
+        learned port names are valid for the same binary version and arguments
+        """
+        try:
+            version = int(os.stat(call[0]).st_mtime)
+        except OSError:
+            version = 0
+        return "{name}:{version}:{call}".format(name=self.app.get('name', ''),
+                                               version=version,
+                                               call=" ".join(call))
+
+    def get_ready_checks(self):
+        """Get Ready Checks
+        ready: jack, window - from mod or ecosystem config, defaults to
+        jack when the app declare ports and window when it has a display
+        """
+        ready = self.config.get('ready', self.app.get('ready', None))
+        if ready is not None:
+            return set([check.strip() for check in ready.split(",") if check.strip() in ('jack', 'window')])
+        checks = set()
+        if self.get_ports():
+            checks.add('jack')
+        if self.opendsp.get_display(self.config.get('display')) is not None and self.opendsp.display.can_watch():
+            checks.add('window')
+        return checks
+
+    def get_ports(self):
+        return [port.replace('"', '').strip()
+                for port_type in ('audio_input', 'audio_output', 'midi_input', 'midi_output')
+                for port in self.data.get(port_type, [])
+                if port.replace('"', '').strip()]
+
+    def check_ready(self):
+        """Check Ready
+        called on start and on each jack graph change until we are ready
+        """
+        if self.data.get('ready', True):
+            return
+        if 'jack' in self.data['ready_wait']:
+            if all(self.opendsp.jackd.has_port(port) for port in self.get_ports()):
+                self.data['ready_wait'].discard('jack')
+        if len(self.data['ready_wait']) == 0:
+            self.set_ready()
+
+    def window_mapped(self, pid):
+        # window belongs to our process or any of its group?
+        if self.data.get('ready', True) or 'proc' not in self.data:
+            return
+        try:
+            if pid != self.data['proc'].pid and os.getpgid(pid) != self.data['proc'].pid:
+                return
+        except OSError:
+            return
+        self.data['ready_wait'].discard('window')
+        self.check_ready()
+
+    def clear_ready(self):
+        # stop readiness watch of current instance, timer and pending checks
+        if 'ready_timer' in self.data:
+            self.data['ready_timer'].cancel()
+        self.data['ready'] = True
+        self.data['ready_wait'] = set()
+
+    def ready_timeout(self):
+        if self.data.get('ready', True):
+            return
+        logging.warning("app {name} not ready on time, still waiting for: {wait}"
+                        .format(name=self.name, wait=", ".join(self.data['ready_wait'])))
+        self.set_ready()
+
+    def set_ready(self):
+        self.data['ready'] = True
+        self.data['ready_timer'].cancel()
+        logging.info("app {name} is ready".format(name=self.name))
+        if self.on_ready is not None:
+            self.on_ready()
+
     def load_project(self, project):
         try:
             # stop the current app process
@@ -113,19 +287,126 @@ class App:
                                   app=self.app['name'],
                                   message=str(e)))
 
-    def check_health(self):
-        pass
+    def has_standby(self):
+        standby = self.config.get('standby', self.app.get('standby', 'no'))
+        return str(standby).strip().lower() in ('yes', 'true', 'on', '1')
 
-    def connection_handler(self):
-        # any pending connections to handle?
-        if len(self.connections_pending) > 0:
-            # generic opendsp call to connect port pairs, returns the non connected ports - still pending...
-            self.connections_pending = self.opendsp.jackd.connect(self.connections_pending)
+    def standby_fits(self):
+        """Standby Fits
+        room for a second instance of us, plus standby_reserve MB left?
+        """
+        reserve = float(self.config.get('standby_reserve', self.app.get('standby_reserve', 128))) * 1024
+        try:
+            with open("/proc/{pid}/status".format(pid=self.data['proc'].pid)) as status:
+                rss = int(re.search(r'VmRSS:\s+(\d+)', status.read()).group(1))
+            with open('/proc/meminfo') as meminfo:
+                available = int(re.search(r'MemAvailable:\s+(\d+)', meminfo.read()).group(1))
+        except (OSError, AttributeError, KeyError):
+            return False
+        return available - rss > reserve
+
+    def prepare_standby(self, project):
+        """Prepare Standby
+        pre launch a second instance of us with project loaded, on the
+        virtual display and with no connections, for a gapless switch.
+        on our own display it could take the focus, and with it the
+        init and midi_map keystrokes meant for the active instance
+        """
+        if not self.has_standby() or not self.is_running() or project is None:
+            return
+        if project == self.config.get('project'):
+            return
+        if self.standby is not None and self.standby['project'] == project:
+            return
+        self.retire_standby()
+        if not self.standby_fits():
+            logging.info("app {name} standby for {project} does not fit in memory"
+                         .format(name=self.name, project=project))
+            return
+        self.standby = {'project': project, 'proc': None}
+        self.opendsp.display.when_ready(STANDBY_DISPLAY, self.spawn_standby, project)
+
+    def spawn_standby(self, project):
+        # retired or replaced while waiting for display?
+        if self.standby is None or self.standby['project'] != project or self.standby['proc'] is not None:
+            return
+        # jack clients before it, the new one is our standby
+        self.standby['clients'] = self.opendsp.jackd.reconciler.get_snapshot().get_clients()
+        self.standby['proc'] = self.opendsp.start_proc(self.get_call(project), STANDBY_DISPLAY)
+        if 'limits' in self.app:
+            self.opendsp.set_limits(self.standby['proc'].pid, self.app['limits'])
+        logging.info("app {name} standby instance for {project} launched"
+                     .format(name=self.name, project=project))
+
+    def retire_standby(self):
+        if self.standby is None:
+            return
+        if self.standby['proc'] is not None:
+            self.opendsp.stop_proc(self.standby['proc'])
+        self.standby = None
+
+    def get_standby_client(self):
+        """Get Standby Client
+        (active, standby) jack client names once standby registered all
+        the ports we have, None otherwise
+        """
+        snapshot = self.opendsp.jackd.reconciler.get_snapshot()
+        ports = [port for port in [snapshot.match(pattern) for pattern in self.get_ports()] if port is not None]
+        if not ports:
+            return None
+        active = ports[0].split(':', 1)[0]
+        # jack renames same name clients to name-01, name-02...
+        base = re.sub(r'-\d+$', '', active)
+        for client in snapshot.get_clients() - self.standby['clients']:
+            if re.sub(r'-\d+$', '', client) != base:
+                continue
+            if all(client + port[len(active):] in snapshot.names
+                   for port in ports if port.startswith(active + ':')):
+                return active, client
+        return None
+
+    def swap_standby(self, project):
+        """Swap Standby
+        swaps jack connections into standby instance and retires the
+        active one, False when there is no standby ready for project
+        """
+        if self.standby is None or self.standby['project'] != project or self.standby['proc'] is None:
+            return False
+        if self.standby['proc'].poll() is not None or not self.is_running():
+            self.retire_standby()
+            return False
+        clients = self.get_standby_client()
+        if clients is None:
+            logging.info("app {name} standby for {project} not ready"
+                         .format(name=self.name, project=project))
+            return False
+        # learned port names of the standby go under its own launch key
+        self.opendsp.jackd.reconciler.swap(*clients, owner=self.name,
+                                           key=self.get_cache_key(self.get_call(project)))
+        active = self.data['proc']
+        self.data['proc'] = self.standby['proc']
+        # x windows can not move between servers, we live on the standby
+        # display from now on and keystrokes follow us there. next start
+        # takes us back home
+        self.data['display'] = STANDBY_DISPLAY
+        self.standby = None
+        self.opendsp.supervisor.watch(self.data['proc'], self.name, self.restart, self.get_policy())
+        self.opendsp.stop_proc(active)
+        self.config['project'] = project
+        logging.info("app {name} swapped to standby instance with project {project}"
+                     .format(name=self.name, project=project))
+        return True
+
+    def get_policy(self):
+        # restart policy from ecosystem, mod config can overwrite it
+        policy = dict(self.app)
+        policy.update({option: self.config[option]
+                       for option in self.config if 'restart' in option})
+        return policy
+
+    def check_health(self):
+        return self.opendsp.supervisor.status(self.data.get('proc'), self.name)
 
     def connection_reset(self):
-        # reset made up connection only
-        if len(self.connections_pending) < len(self.connections):
-            # ask opendsp core to do so...
-            self.opendsp.jackd.disconnect(self.connections)
-        # reset connections pending
-        self.connections_pending = self.connections
+        # disconnect made up connections, reconciler makes them again
+        self.opendsp.jackd.reconciler.reset(self.name)
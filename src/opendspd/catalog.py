@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import logging
+
+from . import inotify
+
+# midi programs per bank
+BANK_SIZE = 128
+
+class Catalog():
+    """Catalog
+    in memory sorted lists of mods and projects per mod directory,
+    each directory is read once and invalidated by inotify, so index
+    lookups never touch the sd card. without inotify every lookup
+    reads the directory again
+
+    Usage::
+
+        >>> opendsp.catalog.get_mod(3, bank=1)
+        >>> opendsp.catalog.get_project('/home/opendsp/data/mod/synth/prj', '.h2song', 0)
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        self.path_mods = "{path_data}/mod".format(path_data=opendsp.path_data)
+        self.mods = None
+        # (path, extension) -> sorted names
+        self.projects = {}
+        # path -> watch descriptor
+        self.watches = {}
+
+    def watch(self, path):
+        """Watch
+        True when path changes are being watched
+        """
+        if path in self.watches:
+            return True
+        if self.opendsp.inotify is None:
+            return False
+        try:
+            self.watches[path] = self.opendsp.inotify.add_watch(path, inotify.IN_DIR_CHANGES, self.invalidate)
+            return True
+        except OSError as e:
+            logging.warning("catalog not watching {path}: {message}".format(path=path, message=e))
+            return False
+
+    def invalidate(self, path, name, mask):
+        if path == self.path_mods and mask & inotify.IN_ISDIR:
+            self.mods = None
+        for key in [key for key in self.projects if key[0] == path]:
+            del self.projects[key]
+        # directory itself gone, kernel drops the watch
+        if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+            self.opendsp.inotify.rm_watch(self.watches.pop(path, None))
+            if path == self.path_mods:
+                self.mods = None
+        # menus, state snapshot and subscribers
+        self.opendsp.notify('catalog', {'path': path})
+
+    def get_mods(self):
+        # sorted list of installed mods inside mod path
+        if self.mods is not None:
+            return self.mods
+        try:
+            mods = sorted(next(os.walk(self.path_mods))[1])
+        except StopIteration:
+            mods = []
+        if self.watch(self.path_mods):
+            self.mods = mods
+        return mods
+
+    def get_projects(self, path, extension):
+        key = (path, extension)
+        if key in self.projects:
+            return self.projects[key]
+        try:
+            # same as glob <path>/*<extension>, hidden ones out
+            projects = sorted([name for name in os.listdir(path)
+                               if name.endswith(extension) and not name.startswith('.')])
+        except OSError:
+            projects = []
+        if self.watch(path):
+            self.projects[key] = projects
+        return projects
+
+    def get_mod(self, idx, bank=0):
+        return self.get_item(self.get_mods(), idx, bank)
+
+    def get_project(self, path, extension, idx, bank=0):
+        return self.get_item(self.get_projects(path, extension), idx, bank)
+
+    def get_item(self, items, idx, bank=0):
+        # bank select addresses libraries bigger than 128
+        if len(items) > 0:
+            return items[(bank * BANK_SIZE + idx) % len(items)]
+        return None
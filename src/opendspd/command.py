@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import itertools
+import threading
+import collections
+import logging
+
+# a newer command of this kind drops pending ones of the listed kinds
+SUPERSEDES = {
+    'restart': ('restart', 'mod', 'project'),
+    'mod': ('mod', 'project'),
+    'project': ('project',),
+    # force display only restarts, and supersedes, when it changes something
+    'display': ('display',),
+}
+
+class CommandExecutor():
+    """Command Executor
+    single entry point for state changing commands from OSC, MIDI and
+    menus. submit() is thread safe and returns at once, commands runs
+    one by one inside core loop, yielding to it between them. a newer
+    mod or project load drops the older pending ones, latest wins
+
+    Usage::
+
+        >>> opendsp.commands.submit('mod', opendsp.load_mod, 'synth')
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        # key -> (id, kind, callback, args), insertion ordered
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.counter = itertools.count(1)
+
+    def submit(self, kind, callback, *args):
+        """Submit
+        kind is one of SUPERSEDES keys for latest wins commands or
+        anything else to simply queue it, returns the command id
+        """
+        return self.queue(kind, callback, args, SUPERSEDES.get(kind, ()))
+
+    def submit_batch(self, commands):
+        """Submit Batch
+        [(kind, callback, args)] from one osc bundle, they run as a
+        single command with nothing in between. latest wins inside
+        the batch too
+        """
+        batch = []
+        supersedes = set()
+        for kind, callback, args in commands:
+            batch = [command for command in batch if command[0] not in SUPERSEDES.get(kind, ())]
+            batch.append((kind, callback, args))
+            supersedes.update(SUPERSEDES.get(kind, ()))
+        return self.queue('batch', self.run_batch, (batch,), supersedes)
+
+    def queue(self, kind, callback, args, supersedes):
+        command_id = next(self.counter)
+        with self.lock:
+            for key in [key for key in self.pending
+                        if self.pending[key][1] in supersedes]:
+                logging.info("command {id} {kind} skipped, superseded by command {new}"
+                             .format(id=self.pending[key][0], kind=self.pending[key][1], new=command_id))
+                del self.pending[key]
+            self.pending[command_id] = (command_id, kind, callback, args)
+            schedule = not self.scheduled
+            self.scheduled = True
+        logging.debug("command {id} {kind} accepted".format(id=command_id, kind=kind))
+        if schedule:
+            self.loop.call_soon(self.run)
+        return command_id
+
+    def cancel(self, kind=None):
+        # drop pending commands, all of them or the ones of a kind
+        with self.lock:
+            for key in [key for key in self.pending
+                        if kind is None or self.pending[key][1] == kind]:
+                del self.pending[key]
+
+    def run(self):
+        with self.lock:
+            if not self.pending:
+                self.scheduled = False
+                return
+            command_id, kind, callback, args = self.pending.popitem(last=False)[1]
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.error("command {id} {kind} failed: {message}"
+                          .format(id=command_id, kind=kind, message=e))
+        # next one on a new loop cycle, so midi, osc and timers get served
+        self.loop.call_soon(self.run)
+
+    def run_batch(self, batch):
+        for kind, callback, args in batch:
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error("batch command {kind} failed: {message}"
+                              .format(kind=kind, message=e))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import time
+import heapq
+import signal
+import itertools
+import threading
+import selectors
+import collections
+import logging
+
+class Timer():
+    """Timer
+    a scheduled callback owned by the event loop,
+    periodic when created with an interval
+    """
+
+    def __init__(self, loop, deadline, callback, args, interval=None):
+        self.loop = loop
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop():
+    """OpenDSP event loop
+
+    Single threaded dispatcher that sleeps until something happens:
+    file descriptors ready to read, timers expiring, signals or
+    callbacks posted from other threads(jack, osc, midi).
+
+    Usage::
+
+        >>> loop = EventLoop()
+        >>> loop.add_timer(5, check_something)
+        >>> loop.call_soon(do_something, arg)
+        >>> loop.run()
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        # timers heap of (deadline, sequence, Timer)
+        self.timers = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        # callbacks posted from any thread or signal handler
+        self.pending = collections.deque()
+        self.running = False
+        self.thread_id = None
+        # self-pipe to wake up select() from other threads and signal handlers
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        os.set_blocking(self.wakeup_write, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, (self.drain_wakeup, ()))
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_write, b'\0')
+        except (BlockingIOError, OSError):
+            # pipe full means a wakeup is already pending
+            pass
+
+    def drain_wakeup(self):
+        try:
+            while os.read(self.wakeup_read, 512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def call_soon(self, callback, *args):
+        """Call Soon
+        thread and signal safe, run callback on next loop pass. signal
+        handlers run on loop thread, set_wakeup_fd wakes select() for them
+        """
+        self.pending.append((callback, args))
+        if threading.get_ident() != self.thread_id:
+            self.wakeup()
+
+    def call_later(self, delay, callback, *args):
+        return self.schedule(Timer(self, time.monotonic() + delay, callback, args))
+
+    def add_timer(self, interval, callback, *args):
+        """Add Timer
+        periodic callback, first call after interval seconds
+        """
+        return self.schedule(Timer(self, time.monotonic() + interval, callback, args, interval))
+
+    def schedule(self, timer):
+        with self.lock:
+            heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+        if threading.get_ident() != self.thread_id:
+            self.wakeup()
+        return timer
+
+    def add_reader(self, fd, callback, *args):
+        self.selector.register(fd, selectors.EVENT_READ, (callback, args))
+
+    def remove_reader(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def stop(self):
+        """Stop
+        signal safe, breaks the run loop on next pass
+        """
+        self.running = False
+        self.wakeup()
+
+    def next_timeout(self):
+        if len(self.pending) > 0:
+            return 0
+        with self.lock:
+            # drop cancelled timers from the top of the heap
+            while self.timers and self.timers[0][2].cancelled:
+                heapq.heappop(self.timers)
+            if not self.timers:
+                return None
+            return max(0, self.timers[0][0] - time.monotonic())
+
+    def run_timers(self):
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            while self.timers and self.timers[0][0] <= now:
+                expired.append(heapq.heappop(self.timers)[2])
+        for timer in expired:
+            if timer.cancelled:
+                continue
+            self.dispatch(timer.callback, timer.args)
+            # periodic timer? get it back into the heap
+            if timer.interval is not None and not timer.cancelled:
+                timer.deadline = max(timer.deadline + timer.interval, now)
+                self.schedule(timer)
+
+    def run_pending(self):
+        # only run what is queued now, new posts go for the next pass
+        for _ in range(len(self.pending)):
+            callback, args = self.pending.popleft()
+            self.dispatch(callback, args)
+
+    def dispatch(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.exception("error on event loop callback {callback}: {message}"
+                              .format(callback=getattr(callback, '__name__', callback),
+                                      message=e))
+
+    def run(self):
+        self.thread_id = threading.get_ident()
+        self.running = True
+        # select() is retried after EINTR with the old timeout, let any
+        # signal write into our pipe so the retry returns at once
+        try:
+            wakeup_fd = signal.set_wakeup_fd(self.wakeup_write, warn_on_full_buffer=False)
+        except ValueError:
+            # not the main thread, no signal handlers for us here
+            wakeup_fd = None
+        try:
+            while self.running:
+                for key, _ in self.selector.select(self.next_timeout()):
+                    callback, args = key.data
+                    self.dispatch(callback, args)
+                self.run_timers()
+                self.run_pending()
+        finally:
+            if wakeup_fd is not None:
+                signal.set_wakeup_fd(wakeup_fd)
+            self.thread_id = None
+
+    def close(self):
+        self.selector.close()
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
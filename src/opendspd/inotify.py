@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+# inotify event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# common mask for "something changed inside this directory"
+IN_DIR_CHANGES = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify():
+    """Inotify
+    minimal ctypes binding to linux inotify, the fd is meant
+    to be registered as a reader on the core event loop
+
+    Usage::
+
+        >>> watcher = Inotify()
+        >>> watcher.add_watch('/home/opendsp/data/updates', IN_DIR_CHANGES, callback)
+        >>> loop.add_reader(watcher.fd, watcher.handle)
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # watch descriptor -> (path, callback)
+        self.watches = {}
+
+    def add_watch(self, path, mask, callback):
+        """Add Watch
+        callback(path, name, mask) is called for each event on path
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.watches[wd] = (path, callback)
+        return wd
+
+    def rm_watch(self, wd):
+        if wd in self.watches:
+            self.libc.inotify_rm_watch(self.fd, wd)
+            del self.watches[wd]
+
+    def handle(self):
+        """Handle
+        read and dispatch all queued events
+        """
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset+length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                if wd not in self.watches:
+                    continue
+                path, callback = self.watches[wd]
+                try:
+                    callback(path, name, mask)
+                except Exception as e:
+                    logging.error("error on inotify callback for {path}: {message}"
+                                  .format(path=path, message=e))
+
+    def close(self):
+        os.close(self.fd)
+        self.watches = {}
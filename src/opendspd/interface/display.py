@@ -15,12 +15,183 @@
 #
 # For a full copy of the GNU General Public License see the doc/GPL.txt file.
 # Common system tools
+import time
+import socket
+import threading
+import subprocess
 import logging
 
+# X window map events support
+try:
+    from Xlib import X
+    from Xlib import display as xdisplay
+except ImportError:
+    xdisplay = None
+
 class DisplayInterface():
     """
-    ...
+    Native(:0) and virtual(:1) displays management, each display is
+    started on its own thread and considered ready once its X server
+    accepts connections on /tmp/.X11-unix/X<n>
     """
 
+    displays = {'native': {'number': 0, 'service': 'display'},
+                'virtual': {'number': 1, 'service': 'vdisplay'}}
+
     def __init__(self, opendsp):
-        pass
+        self.opendsp = opendsp
+        # requested running state
+        self.running = {display: False for display in self.displays}
+        # ready state, wait on it before launch anything on display
+        self.ready = {display: threading.Event() for display in self.displays}
+        # (callback, args) posted once display gets ready, kept across timeouts
+        self.waiting = {display: [] for display in self.displays}
+        self.lock = threading.Lock()
+        self.thread = {}
+
+    def get_timeout(self):
+        return float(self.opendsp.config['system']['system'].get('display_timeout', 10))
+
+    def start(self, display='native'):
+        """Start
+        non blocking, use wait() to know when display is ready
+        """
+        if display not in self.displays:
+            return
+        # callers from core loop and waiter threads, only one of them starts it
+        with self.lock:
+            if self.running[display]:
+                return
+            self.running[display] = True
+            self.ready[display].clear()
+        self.thread[display] = threading.Thread(target=self.run,
+                                                daemon=True,
+                                                args=(display,))
+        self.thread[display].start()
+
+    def stop(self, display='native'):
+        if display not in self.displays:
+            return
+        subprocess.call(['sudo', 'systemctl', 'stop', self.displays[display]['service']], shell=False, env=None)
+        with self.lock:
+            self.running[display] = False
+            self.ready[display].clear()
+
+    def when_ready(self, display, callback, *args):
+        """When Ready
+        non blocking, callback is posted into core loop once display is ready.
+        on timeout it keeps waiting for the next display start
+        """
+        if display in self.displays:
+            with self.lock:
+                if not self.ready[display].is_set():
+                    self.waiting[display].append((callback, args))
+                    callback = None
+        if callback is None:
+            # a display that timed out gets a new try
+            self.start(display)
+            return
+        self.opendsp.loop.call_soon(callback, *args)
+
+    def can_watch(self):
+        # window map events needs python-xlib
+        return xdisplay is not None
+
+    def wait(self, display='native'):
+        """Wait
+        blocks until display is ready or timeout, returns ready state
+        """
+        if display not in self.displays:
+            return False
+        if not self.running[display]:
+            self.start(display)
+        ready = self.ready[display].wait(self.get_timeout())
+        if not ready:
+            logging.error("display {display} not ready after {timeout}s"
+                          .format(display=display, timeout=self.get_timeout()))
+        return ready
+
+    def run(self, display):
+        subprocess.call(['sudo', 'systemctl', 'start', self.displays[display]['service']], shell=False, env=None)
+        number = self.displays[display]['number']
+        # wait display to get up...
+        deadline = time.monotonic() + self.get_timeout()
+        while not self.probe(number):
+            if time.monotonic() > deadline or not self.running[display]:
+                logging.error("timeout waiting for display {display} X server".format(display=display))
+                # let next request try it again
+                self.running[display] = False
+                with self.lock:
+                    waiting = len(self.waiting[display])
+                self.opendsp.loop.call_soon(self.opendsp.notify, 'health',
+                                            {'name': "display:{display}".format(display=display),
+                                             'state': 'failed', 'waiting': waiting})
+                return
+            time.sleep(0.05)
+        if display == 'native':
+            try:
+                # avoid screen auto shutoff
+                environment = { "DISPLAY": ":0" }
+                subprocess.call(['xset', 's', 'off'], shell=False, env=environment)
+                subprocess.call(['xset', '-dpms'], shell=False, env=environment)
+                subprocess.call(['xset', 's', 'noblank'], shell=False, env=environment)
+            except:
+                pass
+        logging.info("display {display} ready".format(display=display))
+        # window map events for apps readiness
+        if self.can_watch():
+            threading.Thread(target=self.watch_windows, daemon=True, args=(display,)).start()
+        with self.lock:
+            self.ready[display].set()
+            waiting, self.waiting[display] = self.waiting[display], []
+        for callback, args in waiting:
+            self.opendsp.loop.call_soon(callback, *args)
+
+    def watch_windows(self, display):
+        """Watch Windows
+        runs on its own thread while display is up, reports each
+        mapped window owner pid to core
+        """
+        try:
+            x = xdisplay.Display(":{number}".format(number=self.displays[display]['number']))
+            root = x.screen().root
+            root.change_attributes(event_mask=X.SubstructureNotifyMask)
+            atom_pid = x.intern_atom('_NET_WM_PID')
+            while self.running[display]:
+                event = x.next_event()
+                if event.type != X.MapNotify:
+                    continue
+                pid = self.window_pid(event.window, atom_pid)
+                if pid is not None:
+                    self.opendsp.loop.call_soon(self.opendsp.window_mapped, display, pid)
+        except Exception as e:
+            logging.info("window watcher for display {display} done: {message}"
+                         .format(display=display, message=e))
+
+    def window_pid(self, window, atom_pid):
+        # window managers reparent clients, look into frame childs too
+        try:
+            windows = [window] + window.query_tree().children
+        except Exception:
+            return None
+        for win in windows:
+            try:
+                prop = win.get_full_property(atom_pid, X.AnyPropertyType)
+                if prop is not None and len(prop.value) > 0:
+                    return int(prop.value[0])
+            except Exception:
+                continue
+        return None
+
+    def probe(self, number):
+        """Probe
+        X server socket accepting connections?
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect("/tmp/.X11-unix/X{number}".format(number=number))
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.close()
@@ -15,10 +15,13 @@
 #
 # For a full copy of the GNU General Public License see the doc/GPL.txt file.
 # Common system tools
+import time
 import logging
 
 import jack
 
+from ..reconciler import Reconciler
+
 class JackdInterface():
     """
     ...
@@ -30,16 +33,39 @@ class JackdInterface():
         self.sys_config = opendsp.config['system']['system']
         self.client = None
         self.proc = {}
+        # client open retry while jackd comes up, and who waits for it
+        self.connect_timer = None
+        self.on_ready = None
+        # desired jack connections from apps and interfaces
+        self.reconciler = Reconciler(self)
 
     def stop(self):
+        if self.connect_timer is not None:
+            self.connect_timer.cancel()
+            self.connect_timer = None
+        self.on_ready = None
+        # no restart waiting on backoff, whoever stops us starts us again
+        self.opendsp.supervisor.cancel('jackd')
+        # leave the server before it goes away
+        if self.client is not None:
+            try:
+                self.client.deactivate()
+                self.client.close()
+            except jack.JackError:
+                pass
+            self.client = None
         # stop all process
-        for proc in self.proc:
-            self.opendsp.stop_proc(self.proc[proc])
+        self.opendsp.stop_procs(self.proc)
         # reset proc
         del self.proc
         self.proc = {}
 
-    def start(self):
+    def start(self, callback=None):
+        """Start
+        with a callback the jack client is opened from core loop as
+        soon as the server accepts it and callback is called then,
+        without it we wait for the server right here(init, no loop yet)
+        """
         priority = 50
         if 'realtime' in self.sys_config:
             # set it +8 for realtime priority
@@ -56,6 +82,10 @@ class JackdInterface():
                                                       '-p', self.config['buffer'],
                                                       '-n', self.config['period'],
                                                       '-s'])
+        # jack server crash takes all jack clients with it, audio subsystem restart
+        self.opendsp.supervisor.watch(self.proc['jackd'], 'jackd', self.opendsp.recover_audio,
+                                      self.opendsp.config['ecosystem']['jackd']
+                                      if 'jackd' in self.opendsp.config['ecosystem'] else None)
 
         # set cpu afinnity?
         if 'cpu' in self.sys_config:
@@ -63,58 +93,92 @@ class JackdInterface():
         # set realtime priority
         if 'realtime' in self.sys_config:
             self.opendsp.set_realtime("jackd", 8)
+        # per thread realtime schema from ecosystem
+        self.opendsp.set_rt_threads("jackd", self.opendsp.config['ecosystem'].get('jackd', 'rt_thread', fallback=None))
 
-        # start jack client
-        self.client = jack.Client('opendsp_jack')
+        # start jack client, as soon as server is up
+        deadline = time.monotonic() + float(self.sys_config.get('jackd_timeout', 10))
+        if callback is None:
+            self.connect_client(deadline)
+            while self.client is None:
+                time.sleep(0.05)
+                self.connect_client(deadline)
+            return
+        self.on_ready = callback
+        self.connect_client(deadline)
+
+    def restart(self, config=None, callback=None):
+        """Restart
+        jackd only restart, optionally with new audio config.
+        desired connections are kept and made again by reconciler,
+        callback is called from core loop once jackd is back
+        """
+        if config is not None:
+            self.config = config
+        logging.info("restarting jackd: rate {rate} buffer {buffer} period {period}"
+                     .format(rate=self.config['rate'], buffer=self.config['buffer'], period=self.config['period']))
+        self.stop()
+        self.start(callback)
+
+    def connect_client(self, deadline):
+        self.connect_timer = None
+        try:
+            self.client = self.get_client()
+        except jack.JackOpenError:
+            crashed = self.proc['jackd'].poll() is not None
+            if not crashed and time.monotonic() < deadline:
+                # not up yet, try again on next loop cycles
+                if self.on_ready is not None:
+                    self.connect_timer = self.opendsp.loop.call_later(0.05, self.connect_client, deadline)
+                return
+            if not crashed:
+                # hung server, supervisor restarts it from scratch
+                self.proc['jackd'].kill()
+            logging.error("jackd not accepting clients after {timeout}s"
+                          .format(timeout=self.sys_config.get('jackd_timeout', 10)))
+            if self.on_ready is None:
+                raise
+            return
+        # jack graph notifications drives our connection handler
+        self.client.set_port_registration_callback(self.port_registration)
+        self.client.set_client_registration_callback(self.client_registration)
+        self.client.set_xrun_callback(self.xrun)
         self.client.activate()
+        callback, self.on_ready = self.on_ready, None
+        if callback is not None:
+            callback()
 
-    def connect(self, connections_pending):
-        connections_made = []
-        for ports in connections_pending:
-            # sanitize special chars from port names
-            port_origin = ports['origin'].replace('(', r'\(').replace(')', r'\)')
-            port_dest = ports['dest'].replace('(', r'\(').replace(')', r'\)')
-            # allow user to regex port expression on jack clients that randon their port names
-            origin = [data.name for data in self.client.get_ports(port_origin)]
-            dest = [data.name for data in self.client.get_ports(port_dest)]
-
-            if len(origin) > 0 and len(dest) > 0:
-                # port pair already connected? append it to connections_made
-                jack_ports = [port.name
-                              for port in self.client.get_all_connections(dest[0])
-                              if port.name == origin[0]]
-                if len(jack_ports) > 0:
-                    connections_made.append(ports)
-                    continue
-
-                try:
-                    self.opendsp.call("/usr/bin/jack_connect \"{port_origin}\" \"{port_dest}\""
-                             .format(port_origin=origin[0], port_dest=dest[0]))
-                    connections_made.append(ports)
-                    logging.info("connect handler found: {port_origin} {port_dest}"
-                                 .format(port_origin=origin[0], port_dest=dest[0]))
-                except Exception as e:
-                    logging.error("error on auto connection: {message}"
-                                  .format(message=e))
-            else:
-                #logging.info("connect handler looking for origin({port_origin}) and dest({port_dest})"
-                #             .format(port_origin=ports['origin'], port_dest=ports['dest']))
-                pass
-        # return connections made successfully
-        return [ports for ports in connections_pending if ports not in connections_made]
+    def get_client(self):
+        # never let the client autostart a server with default settings
+        return jack.Client('opendsp_jack', no_start_server=True)
 
-    def disconnect(self, connections):
-        for ports in connections:
-            try:
-                # allow user to regex port expression on jack clients that randon their port names
-                origin = [data.name for data in self.client.get_ports(ports['origin'])]
-                dest = [data.name for data in self.client.get_ports(ports['dest'])]
-                if len(origin) > 0 and len(dest) > 0:
-                    self.opendsp.call("/usr/bin/jack_disconnect \"{port_origin}\" \"{port_dest}\""
-                             .format(port_origin=origin[0], port_dest=dest[0]))
-            except Exception as e:
-                logging.error("error on reset disconnection: {message}"
-                              .format(message=e))
+    def port_registration(self, port, register):
+        # called from jack notification thread, no server calls here!
+        if register:
+            self.opendsp.request_connections()
+
+    def client_registration(self, name, register):
+        # called from jack notification thread, no server calls here!
+        if register:
+            self.opendsp.request_connections()
+
+    def xrun(self, delay):
+        # called from jack notification thread, no server calls here!
+        self.opendsp.metrics.xrun(delay)
+
+    def reconcile(self):
+        # one graph snapshot for all connection owners
+        return self.reconciler.reconcile()
+
+    def is_rolling(self):
+        # jack transport playing?
+        try:
+            return self.client is not None and self.client.transport_state == jack.ROLLING
+        except jack.JackError:
+            return False
+
+    def has_port(self, port):
+        return self.reconciler.has_port(port)
 
     def get_config(self):
         return self.config
@@ -23,6 +23,7 @@ import subprocess
 import threading
 import importlib
 import glob
+import bisect
 import signal
 import psutil
 import configparser
@@ -30,8 +31,18 @@ import logging
 
 # MIDI Support
 from mididings import *
+from mididings import engine as mididings_engine
 import rtmidi
 
+# timestamped midi output
+from .midiout import MidiScheduler
+
+# system CCs that act by value range, lower bounds of each range after the first
+SYSTEM_ZONES = {
+    # force display: off, native, virtual
+    80: (42, 85),
+}
+
 class MidiInterface():
     """
     ...
@@ -42,7 +53,6 @@ class MidiInterface():
         #self.config = opendsp.config['system']['midi']
         # connections state
         self.connections = []
-        self.connections_pending = []
         # manage the internal state of user midi input auto connections
         self.hid_devices = []
         # midi standard cmd byte definitions
@@ -59,37 +69,65 @@ class MidiInterface():
         # midi registers
         self.midi_register = {'mod_id': 0,
                          'bank_id': 0,
+                         'bank_msb': 0,
                          'project_id': 0}
+        # compiled control dispatch table and coalesced events waiting on it,
+        # (channel, ctrl) -> [values]
+        self.dispatch = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        # last control event, for performing detection
+        self.last_event = 0
+        self.compile({})
+        self.scheduler = None
+        self.midi_out = None
 
     def stop(self):
         # disconnect all ports
-        for port in self.connections:
-            self.opendsp.jackd.disconnect(self.connections)
+        self.opendsp.jackd.reconciler.remove('midi')
+        self.connections = []
+        # pending timestamped messages goes with the output
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
         # destroying rtmidi object
-        del self.midi_out
-        # stop all procs
-        for proc in self.proc:
-            self.opendsp.stop_proc(self.proc[proc])
+        self.midi_out = None
+        # restarts waiting on backoff would bring a second instance up after start()
+        for name in self.proc:
+            self.opendsp.supervisor.cancel(name)
+        # stop all procs and midi devices at once
+        procs = dict(self.proc)
+        procs.update(self.devices)
+        self.opendsp.stop_procs(procs)
         del self.proc
         self.proc = {}
-        # stop all midi devices
-        for device in self.devices:
-            self.opendsp.stop_proc(self.devices[device])
         del self.devices
         self.devices = {}
         self.devices_port = []
         # stop threads
-        #...
+        self.stop_processor()
+
+    def stop_processor(self):
+        # mididings engine runs inside our process, one per start()
+        thread = self.thread.pop('processor', None)
+        if thread is None or not thread.is_alive():
+            return
+        mididings_engine.quit()
+        thread.join(timeout=2)
+        if thread.is_alive():
+            logging.warning("mididings engine did not stop")
 
     def start(self):
         # start a2jmidid to bridge midi data
-        self.proc['a2jmidid'] = self.opendsp.start_proc(['/usr/bin/a2jmidid', '-eu'])
+        self.start_proc('a2jmidid', ['/usr/bin/a2jmidid', '-eu'])
         # set cpu afinnity
         if 'cpu' in self.opendsp.config['system']['system']:
             self.opendsp.set_cpu("a2jmidid", self.opendsp.config['system']['system']['cpu'])
         # set it +4 for realtime priority
         if 'realtime' in self.opendsp.config['system']['system']:
             self.opendsp.set_realtime("a2jmidid", 4)
+        # per thread realtime schema from ecosystem
+        self.opendsp.set_rt_threads("a2jmidid", self.opendsp.config['ecosystem'].get('a2jmidid', 'rt_thread', fallback=None))
 
         # start mididings and a thread for midi input user control and feedback listening
         config(backend='jack', client_name='OpenDSP', in_ports=1)
@@ -102,6 +140,9 @@ class MidiInterface():
         self.midi_out = rtmidi.RtMidiOut()
         # creates alsa_midi:RtMidiOut Client opendsp (out)
         self.midi_out.openVirtualPort("opendsp")
+        # timestamped messages sent from their own thread
+        self.scheduler = MidiScheduler(self.midi_out.send_message, self.set_scheduler_realtime)
+        self.scheduler.start()
 
         if 'midi' in self.opendsp.config['system']:
             # setup midi spliter?
@@ -116,8 +157,8 @@ class MidiInterface():
                 rules = "ChannelSplit({{ {rule_list} }})".format(rule_list=channel_list)
 
                 # call mididings and set it realtime alog with jack - named midi
-                self.proc['mididings'] = self.opendsp.start_proc(['/usr/bin/mididings',
-                                                                '-R', '-c', 'midiRT', '-o', '16', rules])
+                self.start_proc('mididings', ['/usr/bin/mididings',
+                                              '-R', '-c', 'midiRT', '-o', '16', rules])
 
                 # it should be mididings but at process list name appears as python3
                 # set cpu afinnity
@@ -126,6 +167,8 @@ class MidiInterface():
                 # set it +4 for realtime priority
                 if 'realtime' in self.opendsp.config['system']['system']:
                     self.opendsp.set_realtime("python3", 4)
+                # per thread realtime schema from ecosystem
+                self.opendsp.set_rt_threads("python3", self.opendsp.config['ecosystem'].get('mididings', 'rt_thread', fallback=None))
 
                 # channel 16 are mean to control opendsp interface
                 self.port_add('midiRT:out_16', 'OpenDSP:in_1')
@@ -133,124 +176,223 @@ class MidiInterface():
             # start on-board uart to midi? (only if your hardware has onboard serial uart)
             if self.opendsp.config['system']['midi'].getboolean('onboard-uart', fallback=False):
                 # run on background
-                self.proc['onboard'] = self.opendsp.start_proc(['/usr/bin/ttymidi',
-                                                                '-s', self.opendsp.config['system']['midi']['device'],
-                                                                '-b', self.opendsp.config['system']['midi']['baudrate']])
+                self.start_proc('onboard', ['/usr/bin/ttymidi',
+                                            '-s', self.opendsp.config['system']['midi']['device'],
+                                            '-b', self.opendsp.config['system']['midi']['baudrate']],
+                                ecosystem='ttymidi')
                 # set cpu afinnity
                 if 'cpu' in self.opendsp.config['system']['system']:
                     self.opendsp.set_cpu("ttymidi", self.opendsp.config['system']['system']['cpu'])
                 # set it +4 for realtime priority
                 if 'realtime' in self.opendsp.config['system']['system']:
                     self.opendsp.set_realtime("ttymidi", 4)
+                # per thread realtime schema from ecosystem
+                self.opendsp.set_rt_threads("ttymidi", self.opendsp.config['ecosystem'].get('ttymidi', 'rt_thread', fallback=None))
                 # add to state
                 self.port_add('ttymidi:MIDI_in', 'midiRT:in_1')
 
-    def send_message(self, cmd, data1, data2, channel):
+    def start_proc(self, name, call, ecosystem=None):
+        """Start Proc
+        start and supervise a midi subsystem process,
+        restart policy comes from its ecosystem section
+        """
+        ecosystem = ecosystem if ecosystem is not None else name
+        policy = None
+        if ecosystem in self.opendsp.config['ecosystem']:
+            policy = self.opendsp.config['ecosystem'][ecosystem]
+        self.proc[name] = self.opendsp.start_proc(call)
+        self.opendsp.supervisor.watch(self.proc[name], name,
+                                      lambda: self.start_proc(name, call, ecosystem),
+                                      policy)
+
+    def set_scheduler_realtime(self, tid):
+        # same schema as the rest of midi subsystem, realtime +4
+        system = self.opendsp.config['system']['system']
+        request = {'pid': tid}
+        if 'realtime' in system:
+            request['priority'] = min(int(system['realtime']) + 4, 99)
+        if 'cpu' in system:
+            request['cpu'] = system['cpu']
+        if len(request) > 1:
+            self.opendsp.sched.apply([request])
+
+    def send_message(self, cmd, data1, data2, channel, at=None):
+        """Send Message
+        at is the wall clock time to send it, None for right now
+        """
         if cmd in self.midi_cmd:
-            status = (self.midi_cmd[cmd] & 0xf0) | ((channel-1) & 0xf0)
-            message = (status, data1, data2)
+            status = (self.midi_cmd[cmd] & 0xf0) | ((channel-1) & 0x0f)
+            # program change carries a single data byte
+            if cmd == 'program_change':
+                message = (status, data1 & 0x7f)
+            else:
+                message = (status, data1 & 0x7f, data2 & 0x7f)
             logging.debug("sending midi message {cmd}: {message}"
                           .format(cmd=cmd, message=message))
-            self.midi_out.send_message(message)
+            if self.scheduler is not None:
+                self.scheduler.send(message, at)
+            elif self.midi_out is not None:
+                self.midi_out.send_message(message)
 
-    def midi_queue(self, event):
+    def get_stats(self):
+        # midi output jitter statistics
+        if self.scheduler is None:
+            return {}
+        return self.scheduler.get_stats()
+
+    def compile(self, midi_map):
+        """Compile
+        mod midi_map and opendsp system CCs into a per channel, per
+        controller dispatch table:
+            {(channel, ctrl): {'actions': [(min, max, app_id, cmd)], 'system': handler, 'zones': ()}}
+        mod mapped controllers takes precedence over system ones
+        """
+        dispatch = {}
+        for entries in midi_map.values():
+            for entry in entries:
+                channels = [entry['channel']] if entry['channel'] is not None else range(1, 17)
+                for channel in channels:
+                    key = (channel, entry['ctrl'])
+                    dispatch.setdefault(key, {'actions': [], 'system': None, 'zones': ()})
+                    dispatch[key]['actions'].append(entry['range'] + (entry['app_id'], entry['cmd']))
+        for ctrl, handler in self.get_system_map().items():
+            for channel in range(1, 17):
+                key = (channel, ctrl)
+                if key not in dispatch:
+                    dispatch[key] = {'actions': [], 'system': handler, 'zones': SYSTEM_ZONES.get(ctrl, ())}
+        self.dispatch = dispatch
+
+    def get_system_map(self):
+        return {
+            # MOD manage: 3 CCs, 2 interfaces
+            79: self.cc_mod,
+            85: self.cc_mod_select,
+            86: self.cc_mod_change,
+            # standard bank select MSB/LSB, for project libraries bigger than 128
+            0: self.cc_bank_msb,
+            32: self.cc_bank_lsb,
+            # MOD Project: manage 4 CCs, 2 interfaces
+            87: self.cc_project,
+            88: self.cc_project_bank,
+            89: self.cc_project_select,
+            90: self.cc_project_change,
+            # OpenDSP manage
+            83: self.cc_restart,
+            80: self.cc_force_display,
+        }
+
+    def midi_event(self, event):
+        """Midi Event
+        called from mididings thread, keeps only the latest value per
+        controller and zone until core loop dispatch it, so a knob sweep
+        never piles up behind a slow action while a button press and
+        release crossing zones still runs both
+        """
+        self.last_event = time.monotonic()
+        if event.type == PROGRAM:
+            key, value = (event.channel, 'program'), event.program
+        else:
+            key, value = (event.channel, event.ctrl), event.value
+        with self.lock:
+            values = self.pending.get(key)
+            scheduled = values is not None
+            if values and self.get_zone(key, values[-1]) == self.get_zone(key, value):
+                values[-1] = value
+            else:
+                self.pending.setdefault(key, []).append(value)
+        if not scheduled:
+            self.opendsp.loop.call_soon(self.midi_dispatch, key)
+
+    def get_zone(self, key, value):
+        """Get Zone
+        values on the same zone run the very same actions: the matching
+        ranges of a mapped controller, or the value range of a system one
+        """
+        entry = self.dispatch.get(key)
+        if entry is None:
+            return None
+        if entry['actions']:
+            return tuple(index for index, action in enumerate(entry['actions'])
+                         if action[0] <= value <= action[1])
+        return bisect.bisect_right(entry['zones'], value)
+
+    def midi_dispatch(self, key):
+        with self.lock:
+            values = self.pending.pop(key, [])
+        for value in values:
+            self.midi_control(key, value)
+
+    def midi_control(self, key, value):
         # PROGRAM CHANGE messages: for project change at mod level
-        if hasattr(event, 'program'):
-            if self.opendsp.mod is not None:
-                project = self.opendsp.mod.get_project_by_idx(event.program-1)
-                if project is not None:
-                    self.opendsp.mod.load_project(project)
+        if key[1] == 'program':
+            self.cc_project(value-1)
             return
-
         # CTRL messages interface
-        if hasattr(event, 'ctrl'):
-            # change selector - register last received value
-            # change mod action (double press to trigger?)
-            # change project action (double press to trigger?)
-
-            # Dynamic CC handler using pre-parsed midi_map with app_id
-            if self.opendsp.mod is not None:
-                cc_key = f"cc{event.ctrl}"
-                if cc_key in self.opendsp.mod.midi_map:
-                    for entry in self.opendsp.mod.midi_map[cc_key]:
-                        app_id = entry['app_id']
-                        cmd = entry['cmd']
-                        if app_id in self.opendsp.mod.app:
-                            self.opendsp.mod.run_map_action(cmd, app_id=app_id)
-                        else:
-                            logging.warning(f"App {app_id} not found for CC {cc_key}")
-                    return
+        entry = self.dispatch.get(key)
+        if entry is None:
+            return
+        if entry['actions']:
+            actions = [(app_id, cmd)
+                       for value_min, value_max, app_id, cmd in entry['actions']
+                       if value_min <= value <= value_max]
+            if actions and self.opendsp.mod is not None:
+                self.opendsp.mod.run_map_actions(actions)
+        elif entry['system'] is not None:
+            entry['system'](value)
 
-            # MOD manage: 3 CCs, 2 interfaces
-            if event.ctrl == 79:
-                # change mod by value
-                if self.opendsp.mod is not None:
-                    mod = self.opendsp.mod.get_mod_by_idx(event.value)
-                    if mod is not None:
-                        self.opendsp.load_mod(mod)
-                return
-            if event.ctrl == 85:
-                # change mod select CC: select mod(knob)
-                self.midi_register['mod_id'] = event.value
-                return
-            if event.ctrl == 86:
-                # change mod by select CC: change mod(button)
-                if self.opendsp.mod is not None:
-                    mod = self.opendsp.mod.get_mod_by_idx(self.midi_register['mod_id'])
-                    if mod is not None:
-                        self.opendsp.load_mod(mod)
-                return
+    def cc_mod(self, value):
+        # change mod by value
+        self.opendsp.commands.submit('mod', self.opendsp.load_mod_by_idx, value)
 
-            # MOD Project: manage 4 CCs, 2 interfaces
-            if event.ctrl == 87:
-                # change project by value
-                if self.opendsp.mod is not None:
-                    project = self.opendsp.mod.get_project_by_idx(event.value)
-                    if project is not None:
-                        self.opendsp.mod.load_project(project)
-                return
-            if event.ctrl == 88:
-                # change project bank id CC: selec project bank(knob)
-                self.midi_register['bank_id'] = event.value
-                return
-            if event.ctrl == 89:
-                # change project id CC: selec project(knob)
-                self.midi_register['project_id'] = event.value
-                return
-            if event.ctrl == 90:
-                # change project by select CC
-                if self.opendsp.mod is not None:
-                    # self.midi_register['bank_id'] # not implemented yet...
-                    project = self.opendsp.mod.get_project_by_idx(self.midi_register['project_id'])
-                    if project is not None:
-                        self.opendsp.mod.load_project(project)
-                return
+    def cc_mod_select(self, value):
+        # change mod select CC: select mod(knob)
+        self.midi_register['mod_id'] = value
 
-            # OpenDSP manage
-            if event.ctrl == 83:
-                # restart opendspd
-                self.opendsp.restart()
-                return
-
-            if event.ctrl == 80:
-                # force display
-                logging.info("force display!")
-                if 0 <= event.value <= 41:
-                    if 'force_display' in self.opendsp.config['system']['system']:
-                        del self.opendsp.config['system']['system']['force_display']
-                    else:
-                        return
-                elif 42 <= event.value <= 84:
-                    self.opendsp.config['system']['system']['force_display'] = 'native'
-                elif 85 <= event.value <= 127:
-                    self.opendsp.config['system']['system']['force_display'] = 'virtual'
-                self.opendsp.save_system()
-                self.opendsp.restart()
-                return
+    def cc_mod_change(self, value):
+        # change mod by select CC: change mod(button)
+        self.cc_mod(self.midi_register['mod_id'])
+
+    def cc_project(self, value):
+        # change project by value, inside selected bank
+        self.opendsp.commands.submit('project', self.opendsp.load_project_by_idx,
+                                     value, self.midi_register['bank_id'])
+
+    def cc_bank_msb(self, value):
+        self.midi_register['bank_msb'] = value
+        self.midi_register['bank_id'] = value * 128
+
+    def cc_bank_lsb(self, value):
+        self.midi_register['bank_id'] = self.midi_register['bank_msb'] * 128 + value
+
+    def cc_project_bank(self, value):
+        # change project bank id CC: selec project bank(knob)
+        self.midi_register['bank_id'] = value
+
+    def cc_project_select(self, value):
+        # change project id CC: selec project(knob)
+        self.midi_register['project_id'] = value
+
+    def cc_project_change(self, value):
+        # change project by select CC
+        self.cc_project(self.midi_register['project_id'])
+
+    def cc_restart(self, value):
+        # restart opendspd
+        self.opendsp.commands.submit('restart', self.opendsp.restart)
+
+    def cc_force_display(self, value):
+        # force display: off, native or virtual by value range
+        logging.info("force display!")
+        display = None
+        if 42 <= value <= 84:
+            display = 'native'
+        elif 85 <= value <= 127:
+            display = 'virtual'
+        self.opendsp.commands.submit('display', self.opendsp.set_force_display, display)
 
     def processor(self):
         # opendsp midi controlled via program changes and cc messages on channel 16
-        run([PortFilter(16) >> Filter(PROGRAM|CTRL) >> Call(thread=self.midi_queue)])
+        run([PortFilter(16) >> Filter(PROGRAM|CTRL) >> Call(thread=self.midi_event)])
 
     def handle(self):
         """Midi handler
@@ -261,7 +403,6 @@ class MidiInterface():
                 self.a2j_lookup()
                 # jamrouter is not working as expected, let disable for now
                 #self.jamrouter_lookup()
-            self.connections_pending = self.opendsp.jackd.connect(self.connections_pending)
         except Exception as e:
             logging.error("error on midi handle process: {}".format(e))
 
@@ -317,4 +458,4 @@ class MidiInterface():
         connection = {'origin': origin, 'dest': dest}
         logging.debug(f"connecting: {origin} ->  {dest}")
         self.connections.append(connection)
-        self.connections_pending.append(connection)
+        self.opendsp.jackd.reconciler.set('midi', self.connections)
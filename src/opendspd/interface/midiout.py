@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP MIDI Output Scheduler
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+# messages waiting to be sent, anything beyond is dropped
+MAX_QUEUE = 4096
+
+# lateness histogram upper bounds, in microseconds
+JITTER_BUCKETS = (100, 500, 1000, 2000, 5000, 10000)
+
+# messages sent later than this are counted as late, in microseconds
+LATE = 1000
+
+class MidiScheduler():
+    """MIDI Scheduler
+    time ordered queue of midi messages sent by a dedicated thread
+    at their due time, lateness of each message is kept as jitter
+    statistics. the thread sleeps on its condition until the deadline,
+    never spins, so it does not hold the GIL from core loop and jack
+    callbacks
+
+    Usage::
+
+        >>> scheduler = MidiScheduler(midi_out.send_message)
+        >>> scheduler.start()
+        >>> scheduler.send((0x90, 60, 100), at=time.time() + 0.5)
+    """
+
+    def __init__(self, output, setup=None):
+        self.output = output
+        # called from our thread with its tid, realtime priority setup
+        self.setup = setup
+        # (monotonic due time, sequence, message)
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'sent': 0, 'dropped': 0, 'late': 0, 'total': 0.0, 'max': 0.0,
+                      'histogram': [0] * (len(JITTER_BUCKETS) + 1)}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="midi-out", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.queue = []
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def send(self, message, at=None):
+        """Send
+        at is a wall clock time(time.time() based), None sends it now
+        """
+        due = time.monotonic()
+        if at is not None:
+            due += at - time.time()
+        with self.condition:
+            if len(self.queue) >= MAX_QUEUE:
+                self.stats['dropped'] += 1
+                return False
+            heapq.heappush(self.queue, (due, next(self.sequence), message))
+            self.condition.notify()
+        return True
+
+    def run(self):
+        if self.setup is not None:
+            self.setup(threading.get_native_id())
+        while True:
+            with self.condition:
+                while self.running:
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    # a newer message due earlier wakes us up too
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                due, sequence, message = heapq.heappop(self.queue)
+            try:
+                self.output(message)
+            except Exception as e:
+                logging.error("error sending midi message {message}: {error}"
+                              .format(message=message, error=e))
+                continue
+            self.account(time.monotonic() - due)
+
+    def account(self, lateness):
+        lateness = max(lateness, 0) * 1000000
+        stats = self.stats
+        stats['sent'] += 1
+        stats['total'] += lateness
+        stats['max'] = max(stats['max'], lateness)
+        if lateness > LATE:
+            stats['late'] += 1
+        for index, bound in enumerate(JITTER_BUCKETS):
+            if lateness <= bound:
+                stats['histogram'][index] += 1
+                break
+        else:
+            stats['histogram'][-1] += 1
+
+    def get_stats(self):
+        """Get Stats
+        flat jitter statistics, times in microseconds:
+            {'sent': 10, 'late': 0, 'le_100us': 9, 'gt_10000us': 0, ...}
+        """
+        stats = self.stats
+        data = {'sent': stats['sent'],
+                'dropped': stats['dropped'],
+                'late': stats['late'],
+                'queued': len(self.queue),
+                'mean_us': int(stats['total'] / stats['sent']) if stats['sent'] else 0,
+                'max_us': int(stats['max'])}
+        for index, bound in enumerate(JITTER_BUCKETS):
+            data['le_{bound}us'.format(bound=bound)] = stats['histogram'][index]
+        data['gt_{bound}us'.format(bound=JITTER_BUCKETS[-1])] = stats['histogram'][-1]
+        return data
@@ -15,23 +15,166 @@
 #
 # For a full copy of the GNU General Public License see the doc/GPL.txt file.
 # Common system tools
+import time
 import logging
 
 # OSC Support
 from liblo import *
 
+# state events pushed to subscribers as /opendsp/state/<topic>
+TOPICS = ('mod', 'project', 'catalog', 'connection', 'xrun', 'health')
+
+# subscribers we keep track of, newer ones push out the oldest
+MAX_SUBSCRIBERS = 16
+
+# seconds between osc(ntp) 1900 epoch and unix 1970 epoch
+NTP_DELTA = 2208988800
+
+def flatten(data):
+    # {key: value} into key, value, ... osc arguments
+    args = []
+    for key in sorted(data):
+        value = data[key]
+        if value is None:
+            value = ''
+        elif not isinstance(value, (int, float, str)):
+            value = str(value)
+        args.extend([key, value])
+    return args
+
 class OscInterface(ServerThread):
+    """
+    OSC commands and state subscriptions. commands inside a bundle
+    are submitted together and runs as one. subscribers get changed
+    state topics as one bundle, at most push_rate bundles per second
+
+    Usage::
+
+        /opendsp/subscribe [reply port] [topic ...]
+        /opendsp/unsubscribe [reply port] [topic ...]
+    """
 
     def __init__(self, opendsp):
         self.opendsp = opendsp
         self.config = opendsp.config['system']['osc']
+        # commands from the bundle being dispatched, None outside a bundle
+        self.batch = None
+        # wall clock time of the bundle being dispatched, None for immediate
+        self.timetag = None
+        # subscriber url -> {'address': Address, 'topics': set()}
+        self.subscribers = {}
+        # (topic, name) -> osc message, changes waiting for next push
+        self.changes = {}
+        self.push_interval = 1.0 / max(self.config.getfloat('push_rate', 10), 0.1)
+        self.push_last = 0
+        self.push_scheduled = False
         ServerThread.__init__(self, self.config['port'])
+        self.add_bundle_handlers(self.bundle_start, self.bundle_end)
+
+    def bundle_start(self, timetag, *args):
+        self.batch = []
+        # 1/2^32 seconds is the osc immediately timetag
+        self.timetag = timetag - NTP_DELTA if timetag > 1 else None
+
+    def bundle_end(self, *args):
+        batch, self.batch = self.batch, None
+        self.timetag = None
+        if batch:
+            self.opendsp.commands.submit_batch(batch)
+
+    def submit(self, kind, callback, *args):
+        # hold it until the end of the bundle
+        if self.batch is not None:
+            self.batch.append((kind, callback, args))
+        else:
+            self.opendsp.commands.submit(kind, callback, *args)
+
+    def subscribe(self, url, address, topics):
+        if url not in self.subscribers and len(self.subscribers) >= MAX_SUBSCRIBERS:
+            self.subscribers.pop(next(iter(self.subscribers)))
+        subscriber = self.subscribers.setdefault(url, {'address': address, 'topics': set()})
+        subscriber['topics'].update(topics)
+        logging.info("osc subscriber {url}: {topics}"
+                     .format(url=url, topics=", ".join(sorted(subscriber['topics']))))
+        # current state, so clients starts coherent
+        self.send_bundle(address, [message for message in self.get_state_messages()
+                                   if message.path.split('/')[-1] in topics])
+
+    def unsubscribe(self, url, topics):
+        if url not in self.subscribers:
+            return
+        self.subscribers[url]['topics'].difference_update(topics)
+        if not self.subscribers[url]['topics']:
+            del self.subscribers[url]
+        logging.info("osc unsubscribed {url}".format(url=url))
+
+    def get_state_messages(self):
+        mod = self.opendsp.mod
+        messages = []
+        if mod is not None:
+            messages.append(Message('/opendsp/state/mod', *flatten({'name': mod.name})))
+            if mod.main_app in mod.app:
+                messages.append(Message('/opendsp/state/project',
+                                        *flatten({'mod': mod.name,
+                                                  'name': mod.app[mod.main_app].config.get('project', '')})))
+        return messages
+
+    def publish(self, topic, data):
+        """Publish
+        state change for subscribers, changes of the same topic(and
+        name) coalesce until next push
+        """
+        if topic not in TOPICS or not self.subscribers:
+            return
+        self.changes[(topic, data.get('name') if topic == 'health' else None)] = \
+            Message('/opendsp/state/{topic}'.format(topic=topic), *flatten(data))
+        if not self.push_scheduled:
+            self.push_scheduled = True
+            delay = max(0, self.push_last + self.push_interval - time.monotonic())
+            self.opendsp.loop.call_later(delay, self.push)
+
+    def push(self):
+        self.push_scheduled = False
+        self.push_last = time.monotonic()
+        changes, self.changes = self.changes, {}
+        for subscriber in list(self.subscribers.values()):
+            self.send_bundle(subscriber['address'],
+                             [changes[key] for key in changes if key[0] in subscriber['topics']])
+
+    def send_bundle(self, address, messages):
+        if not messages:
+            return
+        try:
+            self.send(address, Bundle(*messages))
+        except Exception as e:
+            logging.error("error pushing osc state to {url}: {message}"
+                          .format(url=address.url, message=e))
+
+    @make_method('/opendsp/subscribe', None)
+    def state_subscribe(self, path, args, types, src):
+        """/opendsp/subscribe [reply port] [topic ...]"""
+        address, topics = self.get_subscription(args, types, src)
+        self.opendsp.loop.call_soon(self.subscribe, address.url, address, topics)
+
+    @make_method('/opendsp/unsubscribe', None)
+    def state_unsubscribe(self, path, args, types, src):
+        """/opendsp/unsubscribe [reply port] [topic ...]"""
+        address, topics = self.get_subscription(args, types, src)
+        self.opendsp.loop.call_soon(self.unsubscribe, address.url, topics)
+
+    def get_subscription(self, args, types, src):
+        # reply to sender port, unless told otherwise
+        port = src.port
+        if types[:1] == 'i':
+            port = args[0]
+        topics = set([arg for arg in args if isinstance(arg, str) and arg in TOPICS]) or set(TOPICS)
+        return Address(src.hostname, port), topics
 
     @make_method('/opendsp/system/restart', '')
     def system_restart(self, path, args):
         """/opendsp/system/restart"""
         # restart opendspd
-        self.opendsp.restart()
+        self.submit('restart', self.opendsp.restart)
 
     @make_method('/opendsp/display/force_screen', 's')
     def display_force_screen(self, path, args):
@@ -39,12 +182,8 @@ class OscInterface(ServerThread):
         screen = args[0]
         # force display
         logging.info("force screen!")
-        if screen == 'off' and 'force_display' in self.opendsp.config['system']['system']:
-            del self.opendsp.config['system']['system']['force_display']
-        else:
-            self.opendsp.config['system']['system']['force_display'] = screen
-        self.opendsp.save_system()
-        self.opendsp.restart()
+        self.submit('display', self.opendsp.set_force_display,
+                    None if screen == 'off' else screen)
 
     @make_method('/opendsp/display/force_on', 's')
     def display_force_on(self, path, args):
@@ -56,27 +195,64 @@ class OscInterface(ServerThread):
         """/opendsp/mod/load [module_id] [module_bank]"""
         logging.debug("Loading module > '%s'" % path)
         mod_id, mod_bank = args
-        if self.opendsp.mod is not None:
-            mod = self.opendsp.mod.get_mod_by_idx(mod_id)
-            if mod is not None:
-                self.opendsp.load_mod(mod)
+        self.submit('mod', self.opendsp.load_mod_by_idx, mod_id, mod_bank)
+
+    @make_method('/opendsp/mod/load_name', 's')
+    def mod_load_name(self, path, args):
+        """/opendsp/mod/load_name [mod name]"""
+        logging.debug("Loading module > '%s'" % path)
+        self.submit('mod', self.opendsp.load_mod_by_name, args[0])
+
+    @make_method('/opendsp/project/load_name', 's')
+    def prj_call_name(self, path, args):
+        """/opendsp/project/load_name [project name]"""
+        logging.debug("Loading project > '%s'" % path)
+        self.submit('project', self.opendsp.load_project_by_name, args[0])
 
     @make_method('/opendsp/project/load', 'ii')
     def prj_call(self, path, args):
         """/opendsp/project/load [project_id] [project_bank]"""
         logging.debug("Loading project > '%s'" % path)
         project_id, project_bank = args
-        if self.opendsp.mod is not None:
-            project = self.opendsp.mod.get_project_by_idx(project_id)
-            if project is not None:
-                self.opendsp.mod.load_project(project)
+        self.submit('project', self.opendsp.load_project_by_idx, project_id, project_bank)
+
+    @make_method('/opendsp/project/queue', 'ii')
+    def prj_queue(self, path, args):
+        """/opendsp/project/queue [project_id] [project_bank]"""
+        logging.debug("Queueing project > '%s'" % path)
+        project_id, project_bank = args
+        self.submit('queue', self.opendsp.queue_project_by_idx, project_id, project_bank)
 
     @make_method('/opendsp/osc2midi', 'siii')
     def midi_call(self, path, args):
+        """/opendsp/osc2midi [cmd] [channel] [data1] [data2]"""
         logging.debug("OSC-to-MIDI > '%s'" % path)
         cmd, channel, data1, data2 = args
+        # inside a timetagged bundle it goes out at bundle time
         if cmd in self.opendsp.midi.midi_cmd:
-            self.opendsp.midi.send_message(cmd, data1, data2, channel)
+            self.opendsp.midi.send_message(cmd, data1, data2, channel, self.timetag)
+
+    @make_method('/opendsp/metrics', '')
+    def metrics(self, path, args, types, src):
+        """/opendsp/metrics, replies jack health metrics summary"""
+        self.send(src, Message('/opendsp/metrics', *flatten(self.opendsp.metrics.get_summary())))
+
+    @make_method('/opendsp/telemetry', None)
+    def telemetry(self, path, args, types, src):
+        """/opendsp/telemetry [app name], replies one message per app"""
+        name = args[0] if types[:1] == 's' else None
+        # telemetry samples inside core loop, read it from there too
+        self.opendsp.loop.call_soon(self.telemetry_reply, src, name)
+
+    def telemetry_reply(self, src, name):
+        summary = self.opendsp.telemetry.get_summary(name)
+        self.send_bundle(src, [Message('/opendsp/telemetry/app', 'name', app_name, *flatten(summary[app_name]))
+                               for app_name in sorted(summary)])
+
+    @make_method('/opendsp/midi/stats', '')
+    def midi_stats(self, path, args, types, src):
+        """/opendsp/midi/stats, replies midi output jitter statistics"""
+        self.send(src, Message('/opendsp/midi/stats', *flatten(self.opendsp.midi.get_stats())))
 
     @make_method(None, None)
     def fallback(self, path, args):
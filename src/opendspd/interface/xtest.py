@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP XTEST Input Interface
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import re
+import functools
+import subprocess
+import logging
+
+# XTEST support
+try:
+    from Xlib import X, XK
+    from Xlib import display as xdisplay
+    from Xlib.ext import xtest
+    from Xlib.protocol import event as xevent
+except ImportError:
+    xdisplay = None
+
+# xdotool modifiers alias
+MODIFIERS = {'ctrl': 'Control_L',
+             'control': 'Control_L',
+             'alt': 'Alt_L',
+             'shift': 'Shift_L',
+             'super': 'Super_L',
+             'meta': 'Meta_L'}
+
+# xdotool commands we know how to inject, anything else goes to xdotool
+COMMANDS = ('key', 'keydown', 'keyup', 'type',
+            'mousemove', 'mousemove_relative', 'click', 'mousedown', 'mouseup',
+            'search', 'windowactivate', 'windowfocus')
+
+# xdotool options followed by a value
+OPTION_VALUES = ('--delay', '--repeat', '--window', '--limit', '--screen', '--desktop')
+
+# options we know how to handle per command, --delay between keys has
+# no use here, nothing to wait for or clear as we inject synchronously
+IGNORED = ('--sync', '--clearmodifiers')
+OPTIONS = {'key': ('--delay',),
+           'keydown': ('--delay',),
+           'keyup': ('--delay',),
+           'type': ('--delay',),
+           'mousemove': ('--delay',),
+           'mousemove_relative': ('--delay',),
+           'click': ('--repeat',),
+           'mousedown': ('--repeat',),
+           'mouseup': ('--repeat',),
+           'search': ('--name', '--class', '--classname', '--onlyvisible'),
+           'windowactivate': ('--delay',),
+           'windowfocus': ('--delay',)}
+
+class Unsupported(Exception):
+    pass
+
+def parse_action(action):
+    """Parse Action
+    xdotool command line into [(command, {options}, [args])],
+    xdotool chains commands on the same line. raises Unsupported for
+    anything we can not inject, before a single event is sent
+    """
+    argv = action.strip().split() if isinstance(action, str) else list(action)
+    if not argv or argv[0] not in COMMANDS:
+        raise Unsupported(" ".join(argv))
+    commands = []
+    argv = iter(argv)
+    for arg in argv:
+        if arg in COMMANDS:
+            commands.append((arg, {}, []))
+        elif arg.startswith('--'):
+            value = next(argv, None) if arg in OPTION_VALUES else True
+            if arg in IGNORED:
+                continue
+            if arg not in OPTIONS[commands[-1][0]]:
+                raise Unsupported("{command} {option} not supported".format(command=commands[-1][0], option=arg))
+            commands[-1][1][arg] = value
+        else:
+            commands[-1][2].append(arg)
+    return commands
+
+class XTestInterface():
+    """
+    Key, mouse and window actions injected via XTEST extension over
+    one persistent connection per display, a subset of xdotool used
+    by mod.cfg init and midi_map. not supported actions falls back
+    to a xdotool process
+
+    Usage::
+
+        >>> opendsp.xtest.run('native', ['key ctrl+s', 'key space'])
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        # display name -> Xlib display connection
+        self.conn = {}
+
+    def get_conn(self, display):
+        if display in self.conn:
+            return self.conn[display]
+        number = self.opendsp.display.displays[display]['number']
+        conn = xdisplay.Display(":{number}".format(number=number))
+        if not conn.has_extension('XTEST'):
+            conn.close()
+            raise Unsupported("no XTEST extension on display :{number}".format(number=number))
+        self.conn[display] = conn
+        return conn
+
+    def close(self, display=None):
+        for name in [display] if display is not None else list(self.conn):
+            conn = self.conn.pop(name, None)
+            if conn is None:
+                continue
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def run(self, display, actions):
+        """Run
+        resolve all actions into events first and only then inject
+        and flush them at once, so a failing action never leaves half
+        of them sent before the xdotool fallback
+        """
+        if xdisplay is None:
+            return self.fallback(display, actions)
+        try:
+            commands = [parse_action(action) for action in actions]
+        except Unsupported:
+            return self.fallback(display, actions)
+        # a display restart leaves us with a dead connection, try a fresh one
+        for attempt in range(2):
+            try:
+                conn = self.get_conn(display)
+                events = []
+                for command in commands:
+                    self.inject(conn, command, events)
+            except Unsupported as e:
+                logging.warning("xtest: {message}".format(message=e))
+                break
+            except Exception as e:
+                logging.warning("xtest connection error on display {display}: {message}"
+                                .format(display=display, message=e))
+                self.close(display)
+                continue
+            try:
+                for event in events:
+                    event()
+                conn.flush()
+                return True
+            except Exception as e:
+                # half sent, a replay would inject it twice
+                logging.error("xtest error injecting on display {display}: {message}"
+                              .format(display=display, message=e))
+                self.close(display)
+                return False
+        return self.fallback(display, actions)
+
+    def fallback(self, display, actions):
+        environment = {"DISPLAY": ":{number}".format(number=self.opendsp.display.displays[display]['number'])}
+        for action in actions:
+            call = ["xdotool"] + (action.strip().split() if isinstance(action, str) else list(action))
+            try:
+                logging.debug("running xdotool command: {call} [DISPLAY={display}]"
+                              .format(call=" ".join(call), display=environment['DISPLAY']))
+                subprocess.call(call, shell=False, env=environment)
+            except Exception as e:
+                logging.error("failed to run xdotool command {call}: {message}"
+                              .format(call=call, message=e))
+        return False
+
+    def inject(self, conn, commands, events):
+        # window stack from last search, used as %1, %@...
+        windows = []
+        for command, options, args in commands:
+            if command in ('key', 'keydown', 'keyup'):
+                for combo in args:
+                    self.key(conn, combo, command, events)
+            elif command == 'type':
+                for char in " ".join(args):
+                    self.key_char(conn, char, events)
+            elif command in ('mousemove', 'mousemove_relative'):
+                x, y = [int(value) for value in args[:2]]
+                events.append(functools.partial(xtest.fake_input, conn, X.MotionNotify,
+                                                detail=command == 'mousemove_relative', x=x, y=y))
+            elif command in ('click', 'mousedown', 'mouseup'):
+                button = int(args[0]) if args else 1
+                for i in range(int(options.get('--repeat', 1))):
+                    if command != 'mouseup':
+                        events.append(functools.partial(xtest.fake_input, conn, X.ButtonPress, button))
+                    if command != 'mousedown':
+                        events.append(functools.partial(xtest.fake_input, conn, X.ButtonRelease, button))
+            elif command == 'search':
+                windows = self.search(conn, options, args)
+            elif command in ('windowactivate', 'windowfocus'):
+                for window in self.get_windows(conn, windows, args):
+                    if command == 'windowactivate':
+                        events.append(functools.partial(self.activate, conn, window))
+                    else:
+                        events.append(functools.partial(window.set_input_focus, X.RevertToParent, X.CurrentTime))
+
+    def get_keycode(self, conn, name):
+        name = MODIFIERS.get(name.lower(), name)
+        keysym = XK.string_to_keysym(name)
+        if keysym == 0 and len(name) == 1:
+            keysym = self.char_keysym(name)
+        keycode = conn.keysym_to_keycode(keysym)
+        if keycode == 0:
+            raise Unsupported("unknown key {name}".format(name=name))
+        # symbol only avaliable on shifted level?
+        shift = conn.keycode_to_keysym(keycode, 0) != keysym and conn.keycode_to_keysym(keycode, 1) == keysym
+        return keycode, shift
+
+    def char_keysym(self, char):
+        if char == '\n':
+            return XK.string_to_keysym('Return')
+        if char == '\t':
+            return XK.string_to_keysym('Tab')
+        # latin1 keysyms matches the code point, unicode ones are offset
+        if ord(char) < 0x100:
+            return ord(char)
+        return 0x01000000 | ord(char)
+
+    def key(self, conn, combo, command, events):
+        keycodes = []
+        for name in combo.split('+'):
+            keycode, shift = self.get_keycode(conn, name)
+            if shift:
+                keycodes.append(conn.keysym_to_keycode(XK.string_to_keysym('Shift_L')))
+            keycodes.append(keycode)
+        if command != 'keyup':
+            for keycode in keycodes:
+                events.append(functools.partial(xtest.fake_input, conn, X.KeyPress, keycode))
+        if command != 'keydown':
+            for keycode in reversed(keycodes):
+                events.append(functools.partial(xtest.fake_input, conn, X.KeyRelease, keycode))
+
+    def key_char(self, conn, char, events):
+        keycode = conn.keysym_to_keycode(self.char_keysym(char))
+        if keycode == 0:
+            logging.warning("xtest: no keycode for {char!r}".format(char=char))
+            return
+        keycodes = [keycode]
+        if conn.keycode_to_keysym(keycode, 0) != self.char_keysym(char):
+            keycodes.insert(0, conn.keysym_to_keycode(XK.string_to_keysym('Shift_L')))
+        for keycode in keycodes:
+            events.append(functools.partial(xtest.fake_input, conn, X.KeyPress, keycode))
+        for keycode in reversed(keycodes):
+            events.append(functools.partial(xtest.fake_input, conn, X.KeyRelease, keycode))
+
+    def search(self, conn, options, args):
+        """Search
+        windows whose name, class or classname matches the pattern,
+        xdotool search --name/--class/--classname/--onlyvisible
+        """
+        fields = [option[2:] for option in options if option in ('--name', '--class', '--classname')]
+        fields = fields or ['name', 'class', 'classname']
+        regex = re.compile(" ".join(args), re.IGNORECASE)
+        found = []
+        stack = [conn.screen().root]
+        while stack:
+            window = stack.pop(0)
+            try:
+                stack.extend(window.query_tree().children)
+                if '--onlyvisible' in options and window.get_attributes().map_state != X.IsViewable:
+                    continue
+                values = []
+                if 'name' in fields:
+                    values.append(window.get_wm_name() or "")
+                wm_class = window.get_wm_class() or ("", "")
+                if 'classname' in fields:
+                    values.append(wm_class[0])
+                if 'class' in fields:
+                    values.append(wm_class[1])
+            except Exception:
+                # window gone while walking the tree
+                continue
+            if any(regex.search(str(value)) for value in values):
+                found.append(window)
+        return found
+
+    def get_windows(self, conn, windows, args):
+        # %1 (default), %N, %@ from search stack or a window id
+        target = args[0] if args else '%1'
+        if target == '%@':
+            return windows
+        if target.startswith('%'):
+            index = int(target[1:]) - 1
+            return windows[index:index+1] if 0 <= index < len(windows) else []
+        return [conn.create_resource_object('window', int(target, 0))]
+
+    def activate(self, conn, window):
+        # ask window manager, EWMH _NET_ACTIVE_WINDOW from a pager source
+        root = conn.screen().root
+        message = xevent.ClientMessage(window=window,
+                                       client_type=conn.intern_atom('_NET_ACTIVE_WINDOW'),
+                                       data=(32, [2, X.CurrentTime, 0, 0, 0]))
+        root.send_event(message, event_mask=X.SubstructureRedirectMask | X.SubstructureNotifyMask)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import re
+import logging
+
+from . import procwatch
+
+# rule presets, <cpu> is replaced by system.cfg [system] cpu
+PRESETS = {
+    # sound cards irq threads into opendsp system cpu
+    'sound': "snd.*:<cpu>:99, .*audio.*:<cpu>:99",
+    # USB host controllers (for USB audio option)
+    'usb': "ehci.*:<cpu>:90, xhci.*:<cpu>:90, ohci.*:<cpu>:90, dwc_otg.*:<cpu>:90, dwc2.*:<cpu>:90",
+    # timer (essential for system)
+    'timer': "rtc.*:0:80, timer.*:0:80",
+    # ACPI (power management)
+    'acpi': "acpi.*:0:70",
+}
+
+IRQ_THREAD = re.compile(r'^irq/(\d+)-(.*)$')
+
+def read_interrupts():
+    """Read Interrupts
+    {irq number: description} from /proc/interrupts
+    """
+    interrupts = {}
+    try:
+        with open('/proc/interrupts') as data:
+            lines = data.readlines()
+    except OSError:
+        return interrupts
+    if not lines:
+        return interrupts
+    num_cpus = len(lines[0].split())
+    for line in lines[1:]:
+        irq, _, rest = line.partition(':')
+        if not irq.strip().isdigit():
+            continue
+        # skip per cpu counters, what is left is chip, hwirq and device names
+        interrupts[int(irq)] = " ".join(rest.split()[num_cpus:])
+    return interrupts
+
+def read_irq_threads():
+    """Read IRQ Threads
+    [(pid, irq number, name)] of irq/<n>-<name> kernel threads
+    """
+    threads = []
+    for pid in procwatch.list_pids():
+        comm = procwatch.read_comm(pid)
+        if comm is None:
+            continue
+        match = IRQ_THREAD.match(comm)
+        if match:
+            threads.append((pid, int(match.group(1)), match.group(2)))
+    return threads
+
+def parse_rules(rules, cpu):
+    """Parse Rules
+    "pattern:cpu[:priority], ..." into a list of rule dicts,
+    patterns are case insensitive
+    """
+    parsed = []
+    for rule in rules.replace('"', '').replace('<cpu>', cpu).split(","):
+        rule = [data.strip() for data in rule.split(":")]
+        if len(rule) < 2 or not rule[0]:
+            continue
+        data = {'regex': re.compile(rule[0], re.IGNORECASE), 'pattern': rule[0], 'cpu': rule[1]}
+        if len(rule) > 2 and rule[2]:
+            data['priority'] = int(rule[2])
+        parsed.append(data)
+    return parsed
+
+class IrqPlanner():
+    """IRQ Planner
+    declarative irq affinity and priority from system.cfg:
+
+        [irq]
+        presets = sound, usb, timer, acpi
+        rules = "eth0:0:50, mmc.*:0"
+        default_cpu = 0
+        rcu_cpu = 0
+        dry_run = no
+
+    presets goes first and rules after them, last match wins.
+    all changes are applied in one batch via scheduler helper
+    """
+
+    def __init__(self, config, sched):
+        self.sched = sched
+        self.config = config['irq'] if 'irq' in config else {}
+        system = config['system']
+        cpu = system.get('cpu', '0')
+        self.default_cpu = self.config.get('default_cpu', cpu)
+        self.rcu_cpu = self.config.get('rcu_cpu', '0')
+        self.dry_run = self.config.get('dry_run', 'no').strip().lower() in ('yes', 'true', 'on', '1')
+        presets = self.config.get('presets', 'sound, timer, acpi')
+        self.rules = []
+        for preset in [preset.strip() for preset in presets.split(",") if preset.strip()]:
+            if preset not in PRESETS:
+                logging.error("unknown irq preset: {preset}".format(preset=preset))
+                continue
+            self.rules.extend(parse_rules(PRESETS[preset], cpu))
+        self.rules.extend(parse_rules(self.config.get('rules', ''), cpu))
+
+    def match(self, *names):
+        found = None
+        for rule in self.rules:
+            if any(rule['regex'].search(name) for name in names):
+                found = rule
+        return found
+
+    def plan(self):
+        """Plan
+        list of (request, reason) to be applied
+        """
+        plan = []
+        # unload rcu from isolated cpus
+        for pid in procwatch.find_pids('rcu'):
+            plan.append(({'pid': pid, 'threads': True, 'cpu': self.rcu_cpu}, 'rcu'))
+        interrupts = read_interrupts()
+        # hardware irq affinity
+        for irq, description in sorted(interrupts.items()):
+            rule = self.match(description)
+            if rule is not None:
+                plan.append(({'irq': irq, 'cpu': rule['cpu']},
+                             "irq {irq} {description} ({pattern})".format(irq=irq,
+                                                                         description=description,
+                                                                         pattern=rule['pattern'])))
+        # irq kernel threads affinity and priority
+        for pid, irq, name in read_irq_threads():
+            request = {'pid': pid, 'threads': True, 'cpu': self.default_cpu}
+            rule = self.match(name, interrupts.get(irq, ''))
+            reason = "irq/{irq}-{name} (default)".format(irq=irq, name=name)
+            if rule is not None:
+                request['cpu'] = rule['cpu']
+                if 'priority' in rule:
+                    request['priority'] = rule['priority']
+                reason = "irq/{irq}-{name} ({pattern})".format(irq=irq, name=name, pattern=rule['pattern'])
+            plan.append((request, reason))
+        return plan
+
+    def apply(self):
+        plan = self.plan()
+        for request, reason in plan:
+            logging.info("irq plan: {reason} -> cpu {cpu} priority {priority}"
+                         .format(reason=reason,
+                                 cpu=request.get('cpu', '-'),
+                                 priority=request.get('priority', '-')))
+        if self.dry_run:
+            logging.info("irq plan dry run, nothing applied")
+            return plan
+        self.sched.apply([request for request, _ in plan])
+        return plan
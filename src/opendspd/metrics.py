@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import time
+import json
+import array
+import threading
+import contextlib
+import logging
+
+from . import state
+
+# samples kept per ring buffer, 10 minutes at 1 second interval
+RING_SIZE = 600
+
+# xrun events kept with their timestamp and activity tags
+XRUN_HISTORY = 64
+
+# an activity still tags xruns this long after it ends, in seconds
+ACTIVITY_TAIL = 2.0
+
+# dsp load histogram upper bounds, in percent
+LOAD_BUCKETS = (10, 25, 50, 75, 90, 100)
+
+# xrun delay histogram upper bounds, in microseconds
+DELAY_BUCKETS = (100, 500, 1000, 5000, 10000)
+
+class Ring():
+    """Ring
+    fixed size ring buffer backed by a compact array
+    """
+
+    def __init__(self, size=RING_SIZE, typecode='f'):
+        self.data = array.array(typecode, [0] * size)
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self):
+        # oldest first
+        if self.count < self.size:
+            return self.data[:self.count].tolist()
+        return self.data[self.index:].tolist() + self.data[:self.index].tolist()
+
+    def last(self):
+        return self.data[self.index - 1] if self.count else None
+
+def histogram(values, buckets, unit=''):
+    data = {}
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    for index, bound in enumerate(buckets):
+        data['le_{bound}{unit}'.format(bound=bound, unit=unit)] = counts[index]
+    data['gt_{bound}{unit}'.format(bound=buckets[-1], unit=unit)] = counts[-1]
+    return data
+
+class Metrics():
+    """Metrics
+    jack health metrics: xruns with timestamp and what we were doing
+    at that time, sampled dsp load and rolling histograms of load and
+    xrun delay over fixed size ring buffers. summary is pushed to
+    <state path>/metrics.json and answered over OSC
+
+    Usage::
+
+        >>> with opendsp.metrics.activity('mod_load'):
+        ...     opendsp.load_mod('synth')
+        >>> opendsp.metrics.get_summary()
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        self.lock = threading.Lock()
+        # activity name -> nesting count, and when the ended ones ended
+        self.activities = {}
+        self.ended = {}
+        self.xruns = 0
+        self.xrun_events = []
+        self.xrun_delay = Ring(XRUN_HISTORY)
+        self.xrun_scheduled = False
+        self.load = Ring()
+        self.samples = 0
+        self.timer = None
+
+    def start(self):
+        config = self.opendsp.config['system']['metrics'] if 'metrics' in self.opendsp.config['system'] else {}
+        interval = float(config.get('interval', 1))
+        self.file_every = max(int(float(config.get('file_interval', 10)) / interval), 1)
+        self.timer = self.opendsp.loop.add_timer(interval, self.sample)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def begin(self, name):
+        """Begin
+        tags xruns happening from now until end(name), any thread
+        """
+        with self.lock:
+            self.activities[name] = self.activities.get(name, 0) + 1
+
+    def end(self, name):
+        with self.lock:
+            if name not in self.activities:
+                return
+            self.activities[name] -= 1
+            if self.activities[name] == 0:
+                del self.activities[name]
+                self.ended[name] = time.monotonic()
+
+    @contextlib.contextmanager
+    def activity(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def get_activities(self):
+        now = time.monotonic()
+        with self.lock:
+            return sorted(set(self.activities) |
+                          set([name for name in self.ended if now - self.ended[name] < ACTIVITY_TAIL]))
+
+    def xrun(self, delay):
+        """Xrun
+        called from jack notification thread, delay in microseconds
+        """
+        event = {'time': time.time(), 'delay_us': int(delay), 'activity': self.get_activities()}
+        with self.lock:
+            self.xruns += 1
+            self.xrun_delay.append(delay)
+            self.xrun_events = (self.xrun_events + [event])[-XRUN_HISTORY:]
+            schedule = not self.xrun_scheduled
+            self.xrun_scheduled = True
+        if schedule:
+            self.opendsp.loop.call_soon(self.xrun_handler)
+
+    def get_last_xrun(self):
+        # wall clock time of last xrun, 0 for none
+        with self.lock:
+            return self.xrun_events[-1]['time'] if self.xrun_events else 0
+
+    def xrun_handler(self):
+        with self.lock:
+            self.xrun_scheduled = False
+            event = dict(self.xrun_events[-1])
+            event['count'] = self.xruns
+        event['activity'] = ",".join(event['activity'])
+        logging.warning("jack xrun {count}: {delay_us}us {activity}".format(**event))
+        self.opendsp.notify('xrun', event)
+
+    def sample(self):
+        client = self.opendsp.jackd.client if self.opendsp.jackd is not None else None
+        if client is None:
+            return
+        try:
+            self.load.append(client.cpu_load())
+        except Exception as e:
+            logging.debug("error sampling dsp load: {message}".format(message=e))
+            return
+        self.samples += 1
+        if self.samples % self.file_every == 0:
+            self.write()
+
+    def get_summary(self):
+        """Get Summary
+        flat metrics summary, histograms are over the ring buffers
+        """
+        load = self.load.values()
+        with self.lock:
+            delays = self.xrun_delay.values()
+            summary = {'xruns': self.xruns,
+                       'last_xrun': self.xrun_events[-1]['time'] if self.xrun_events else 0}
+        summary['load'] = round(self.load.last() or 0, 2)
+        summary['load_mean'] = round(sum(load) / len(load), 2) if load else 0
+        summary['load_max'] = round(max(load), 2) if load else 0
+        summary['load_samples'] = len(load)
+        summary.update({'load_' + key: value for key, value in histogram(load, LOAD_BUCKETS).items()})
+        summary.update({'xrun_delay_' + key: value for key, value in histogram(delays, DELAY_BUCKETS, 'us').items()})
+        if self.opendsp.jackd is not None:
+            config = self.opendsp.jackd.get_config()
+            summary.update({'rate': int(config['rate']),
+                            'buffer': int(config['buffer']),
+                            'period': int(config['period'])})
+        return summary
+
+    def write(self):
+        with self.lock:
+            xruns = list(self.xrun_events)
+        data = {'time': time.time(),
+                'summary': self.get_summary(),
+                'xruns': xruns,
+                'midi': self.opendsp.midi.get_stats() if self.opendsp.midi is not None else {}}
+        try:
+            os.makedirs(self.opendsp.state.path, exist_ok=True)
+            state.write_atomic(self.opendsp.state.path + '/metrics.json', json.dumps(data, indent=1))
+        except OSError as e:
+            logging.error("error writing metrics: {message}".format(message=e))
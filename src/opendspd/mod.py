@@ -15,16 +15,15 @@
 #
 # For a full copy of the GNU General Public License see the doc/GPL.txt file.
 # Common system tools
-import os
-import time
-import threading
-import subprocess
-import glob
+import re
 import logging
 
 # main App class
 from . import app
 
+# cc<ctrl>[@<channel>][[<min>-<max>]]
+MIDI_MAP_KEY = re.compile(r'^cc(\d+)(?:@(\d+))?(?:\[(\d+)-(\d+)\])?$')
+
 class Mod:
 
     def __init__(self, name_mod, config_mod, ecosystem, opendsp):
@@ -49,16 +48,42 @@ class Mod:
         self.ext_project = ""
         # running state
         self.running = False
-        # running thread
-        self.thread = None
+        # project queued for main app warm standby
+        self.project_queued = None
+        # app_id of started apps not ready yet
+        self.loading = set()
 
-    def stop(self):
+    def stop(self, keep=None):
+        """
+        Stops all apps, except the ones running with the same signature
+        of keep {app_id: App} new mod apps. returns the kept ones
+        """
         self.running = False
-        # delete all Apps objects
+        self.loading.clear()
+        # no more mod actions on midi dispatch
+        self.opendsp.midi.compile({})
+        kept = {}
+        if keep is not None:
+            kept = {app_id: self.app[app_id]
+                    for app_id in self.app
+                    if app_id in keep
+                    and self.app[app_id].is_running()
+                    and self.app[app_id].get_signature() == keep[app_id].get_signature()}
+        # stop all the other Apps objects at once
+        procs = {}
         for app_id in self.app:
-            self.app[app_id].stop()
-
-    def start(self):
+            if app_id in kept:
+                continue
+            procs[app_id] = self.app[app_id].data.get('proc')
+            self.app[app_id].stop(stop_proc=False)
+        self.opendsp.stop_procs(procs)
+        return kept
+
+    def start(self, previous=None):
+        """
+        Starts the mod, apps shared with previous running mod keeps
+        running and only gets rewired to the new connections
+        """
         # construct a dict of apps config objects to be used as mod apps ecosystem
         apps = {app: self.config[app]
                 for app in self.config if 'app' in app}
@@ -82,8 +107,24 @@ class Mod:
                 # generate our list of pair ports connection representation between apps
                 connections = self.gen_conn(app_id, config, config_app)
                 # instantiate App object and keep track of it on app map
-                self.app[app_id] = app.App(config, config_app, connections, self.path, self.opendsp)
-                self.app[app_id].start()
+                self.app[app_id] = app.App(config, config_app, connections, self.path, self.opendsp, app_id)
+
+        # stop previous mod, but the apps we share with it
+        shared = {}
+        init_changed = set()
+        if previous is not None:
+            shared = previous.stop(keep=self.app)
+            for app_id in shared:
+                if shared[app_id].config.get('init') != self.app[app_id].config.get('init'):
+                    init_changed.add(app_id)
+                shared[app_id].adopt(self.app[app_id])
+                self.app[app_id] = shared[app_id]
+                logging.info("app {name} shared with mod {mod}, kept running"
+                             .format(name=shared[app_id].name, mod=previous.name))
+
+        for app_id in self.app:
+            # init commands runs as soon as the app is ready
+            self.app[app_id].on_ready = lambda app_id=app_id: self.app_ready(app_id)
 
         # creates midi_map
         self.create_midi_map()
@@ -91,110 +132,135 @@ class Mod:
         # any init command to automate?
         self.create_init_map()
 
-        # thread the run method until we're dead
-        self.thread = threading.Thread(target=self.run,
-                                       daemon=True,
-                                       args=())
-        self.thread.start()
-
-        # Run init commands for all apps after loading the project
-        # wait a bit since not all apps should be fully initialized
-        # TODO: implement a watch solution instead for init and close
-        time.sleep(10)
-        for app_id in self.init_map:
-            for cmd in self.init_map[app_id]:
-                self.run_map_action(cmd, app_id=app_id)
-
-    def run(self):
         self.running = True
-        while self.running:
-            # handler audio and midi connections from config
-            self.connection_handler()
-            self.check_health()
-            time.sleep(5)
+
+        # mod is loaded once all the apps we launch are ready
+        self.loading = set(self.app) - set(shared)
+
+        # launch them all at once, display apps as soon as their display is ready
+        for app_id in self.app:
+            if app_id in shared:
+                # already up, only init commands when they changed
+                if app_id in init_changed:
+                    self.run_init_map(app_id)
+                continue
+            self.app[app_id].start()
+        # nothing to launch?
+        if len(self.loading) == 0:
+            self.opendsp.mod_loaded(self)
+
+    def app_ready(self, app_id):
+        self.run_init_map(app_id)
+        if app_id == self.main_app:
+            self.prepare_standby()
+        if app_id in self.loading:
+            self.loading.discard(app_id)
+            if len(self.loading) == 0:
+                self.opendsp.mod_loaded(self)
+
+    def prepare_standby(self):
+        """
+        Main app warm standby gets the queued project or the next one
+        """
+        if self.main_app not in self.app:
+            return
+        project = self.project_queued
+        if project is None:
+            projects = self.get_projects()
+            current = self.app[self.main_app].config.get('project')
+            if current in projects:
+                project = projects[(projects.index(current) + 1) % len(projects)]
+            elif projects:
+                project = projects[0]
+        self.app[self.main_app].prepare_standby(project)
+
+    def queue_project(self, project):
+        self.project_queued = project
+        self.prepare_standby()
+
+    def run_init_map(self, app_id):
+        self.run_map_actions([(app_id, cmd) for cmd in self.init_map.get(app_id, [])])
+
+    def ready_handler(self):
+        for app_id in self.app:
+            self.app[app_id].check_ready()
+
+    def window_mapped(self, pid):
+        for app_id in self.app:
+            self.app[app_id].window_mapped(pid)
 
     def run_map_action(self, action, app_id=None):
         """
         Runs a single mapped action command
         Based on xdotool - Read the manual
         """
-        if app_id is None or not hasattr(self, 'opendsp') or self.opendsp.mod is None:
-            logging.warning("No app_id provided or mod not loaded")
-            return
-        #
-        env_display = 0
-        if 'display' in self.app[app_id].config:
-            if self.app[app_id].config['display'] == 'virtual':
-                env_display = 1
-        environment = { "DISPLAY": f":{env_display}" }
-
-        # Normalize input to list format
-        if isinstance(action, str):
-            cmd = ["xdotool"] + action.strip().split()
-        elif isinstance(action, list):
-            cmd = ["xdotool"] + action
-        else:
-            logging.error(f"Invalid action type: {type(action)}")
+        if app_id is None:
+            logging.warning("No app_id provided")
             return
+        self.run_map_actions([(app_id, action)])
 
-        # Run command with proper environment
-        try:
-            logging.debug(f"Running xdotool command: {' '.join(cmd)} [DISPLAY={env_display}]")
-            subprocess.call(cmd, shell=False, env=environment)
-        except Exception as e:
-            logging.error(f"Failed to run command for app {app_id}: {cmd}, error: {e}")
+    def run_map_actions(self, actions):
+        """
+        Runs a batch of [(app_id, action)], one flush per display
+        """
+        batch = {}
+        for app_id, action in actions:
+            if app_id not in self.app:
+                logging.warning("App {app_id} not found for action {action}"
+                                .format(app_id=app_id, action=action))
+                continue
+            display = self.app[app_id].get_display() or 'native'
+            batch.setdefault(display, []).append(action)
+        for display in batch:
+            self.opendsp.xtest.run(display, batch[display])
 
     def load_project(self, project):
-        # only load projects if we have a main app setup
-        if self.main_app in self.app:
-            # reset connections to force new ones before load new project
-            self.connection_reset()
-            self.app[self.main_app].load_project(project)
-            # save mod state
-            self.opendsp.save_mod()
-        else:
-            logging.info("No app1 setup for main app reference on projects")
+        # xruns while we switch are tagged as project switch
+        with self.opendsp.metrics.activity('project_switch'):
+            # only load projects if we have a main app setup
+            if self.main_app in self.app:
+                # warm standby ready with it? swap to it
+                if self.app[self.main_app].swap_standby(project):
+                    self.project_queued = None
+                    self.opendsp.save_mod()
+                    self.opendsp.notify('project', {'mod': self.name, 'name': project})
+                    self.run_init_map(self.main_app)
+                    self.prepare_standby()
+                    return
+                self.project_queued = None
+                # reset connections to force new ones before load new project
+                self.connection_reset()
+                self.app[self.main_app].load_project(project)
+                # save mod state
+                self.opendsp.save_mod()
+                self.opendsp.notify('project', {'mod': self.name, 'name': project})
+            else:
+                logging.info("No app1 setup for main app reference on projects")
 
     def get_projects(self):
         # only read project directory if we have a main app setup
         if self.main_app in self.app:
-            dir_list = glob.glob("{path_project}/*{extension}"
-                                 .format(path_project=self.path_project,
-                                         extension=self.ext_project))
-            return [os.path.basename(path_project)
-                    for path_project in sorted(dir_list)]
+            return self.opendsp.catalog.get_projects(self.path_project, self.ext_project)
         else:
             return []
 
-    def get_project_by_idx(self, idx):
+    def get_project_by_idx(self, idx, bank=0):
         # only read project directory if we have a main app setup
         if self.main_app in self.app:
-            projects = self.get_projects()
-            size = len(projects)
-            if size > 0:
-                return projects[idx % size]
+            return self.opendsp.catalog.get_project(self.path_project, self.ext_project, idx, bank)
         else:
             return None
 
     def get_mods(self):
         # sorted list of installed mods inside mod path
-        return sorted(next(os.walk("{path_data}/mod/"
-                                   .format(path_data=self.opendsp.path_data)))[1])
+        return self.opendsp.catalog.get_mods()
 
-    def get_mod_by_idx(self, idx):
-        mods = self.get_mods()
-        size = len(mods)
-        if size > 0:
-            return mods[idx%size]
-        return None
+    def get_mod_by_idx(self, idx, bank=0):
+        return self.opendsp.catalog.get_mod(idx, bank)
 
     def check_health(self):
-        for app in self.app:
-            self.app[app].check_health()
-
-    def connection_handler(self):
-        for app in self.app:
-            self.app[app].connection_handler()
+        return {app: self.app[app].check_health()
+                for app in self.app}
 
     def connection_reset(self):
         for app in self.app:
@@ -208,25 +274,35 @@ class Mod:
     def create_midi_map(self):
         """
         Pre-process all midi_map entries from apps into a single flat dict:
-            {'cc34': [{'app_id': 'app1', 'cmd': 'key f'}, ...], ...}
+            {'cc34': [{'app_id': 'app1', 'cmd': 'key f', 'ctrl': 34, 'channel': None, 'range': (0, 127)}, ...], ...}
+
+        Entry syntax is cc<ctrl>[@<channel>][[<min>-<max>]]: <cmd>, e.g.
+            midi_map: "cc34: key f, cc35@2[0-63]: key a, cc35@2[64-127]: key b"
         """
         self.midi_map = {}
 
         for app_id in self.app:
             app = self.app[app_id]
             if hasattr(app, 'config') and 'midi_map' in app.config:
-                lines = [line.strip() for line in app.config['midi_map'].split(',') if line.strip()]
+                lines = [line.strip() for line in app.config['midi_map'].replace('"', '').split(',') if line.strip()]
                 for line in lines:
                     if ':' in line:
                         cc_part, cmd = line.split(':', 1)
-                        cc_key = cc_part.strip().lower()
-                        # Split multiple cmds per CC
-                        cmds = [c.strip() for c in cmd.split(',') if c.strip()]
-                        for c in cmds:
-                            entry = {'app_id': app_id, 'cmd': c}
-                            if cc_key not in self.midi_map:
-                                self.midi_map[cc_key] = []
-                            self.midi_map[cc_key].append(entry)
+                        match = MIDI_MAP_KEY.match(cc_part.strip().lower())
+                        if match is None:
+                            logging.error("invalid midi_map entry for app {app_id}: {line}"
+                                          .format(app_id=app_id, line=line))
+                            continue
+                        ctrl, channel, value_min, value_max = match.groups()
+                        entry = {'app_id': app_id,
+                                 'cmd': cmd.strip(),
+                                 'ctrl': int(ctrl),
+                                 'channel': int(channel) if channel is not None else None,
+                                 'range': (int(value_min or 0), int(value_max or 127))}
+                        self.midi_map.setdefault("cc{ctrl}".format(ctrl=ctrl), []).append(entry)
+
+        # compiled into midi interface dispatch table
+        self.opendsp.midi.compile(self.midi_map)
 
     def create_init_map(self):
         """
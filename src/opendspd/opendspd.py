@@ -17,21 +17,46 @@
 # Common system tools
 import os
 import time
-import datetime
 import subprocess
-import glob
 import signal
-import psutil
+import re
 import configparser
 import logging
 
 # Mod handler
 from . import mod
+# main event loop and file watcher
+from . import event
+from . import inotify
+# mods and projects index
+from . import catalog
+# state snapshot and openbox menus
+from . import state
+# jack health metrics
+from . import metrics
+# per app resource usage
+from . import telemetry
+# privileged scheduler helper client
+from . import sched
+# process and threads life cycle watcher
+from . import procwatch
+# irq affinity and priority planner
+from . import irq
+# background update installer
+from . import update
+# child process supervisor
+from . import supervisor
+# serialized, latest wins control commands
+from . import command
 # Interfaces pack(jackd, osc, midi, display)
 from .interface.jackd import JackdInterface
 from .interface.osc import OscInterface
 from .interface.midi import MidiInterface
 from .interface.display import DisplayInterface
+from .interface.xtest import XTestInterface
+
+# seconds to wait for the apps of a loading mod before closing the mod_load tag
+MOD_LOAD_TIMEOUT = 30
 
 class Core():
     """OpenDSP main core
@@ -54,10 +79,10 @@ class Core():
         self.mod = None
         # running state
         self.running = False
-        # display management running state
-        self.display = {}
-        self.display['native'] = False
-        self.display['virtual'] = False
+        # display management
+        self.display = DisplayInterface(self)
+        # key and mouse actions into displays
+        self.xtest = XTestInterface(self)
         # configparser objects, system, ecosystem and mod
         self.config = {}
         self.config['system'] = configparser.ConfigParser()
@@ -65,12 +90,34 @@ class Core():
         self.config['mod'] = {}
         # state attributes
         self.path_data = path_data
-        self.updates_counter = 0
         # rt process
         self.rt_proc = {}
+        self.rt_scan_scheduled = False
+        # privileged helper for affinity, priority and limits
+        self.sched = sched.Scheduler()
+        # main event loop, everything that touches core state runs inside it
+        self.loop = event.EventLoop()
+        # restart crashed child process
+        self.supervisor = supervisor.Supervisor(self)
+        # osc, midi and menu commands
+        self.commands = command.CommandExecutor(self.loop)
+        # watch process as they come and go to apply realtime schema
+        self.procwatch = procwatch.ProcWatcher(self.loop, self.rt_handle, opener=self.sched.open_proc_connector)
+        self.inotify = None
+        self.catalog = catalog.Catalog(self)
+        self.state = state.State(self)
+        self.metrics = metrics.Metrics(self)
+        self.telemetry = telemetry.Telemetry(self)
+        self.updates = None
+        self.connections_scheduled = False
+        # (callback, args) waiting for an audio restart to finish
+        self.audio_pending = None
+        # mod_load metrics tag timeout, while a mod is loading
+        self.mod_loading = None
 
         # setup signal handling
         signal.signal(signal.SIGTERM, self.signal_handler)
+        signal.signal(signal.SIGCHLD, self.child_signal_handler)
 
         # setup log environment
         logging.basicConfig(level=logging.DEBUG)
@@ -80,6 +127,11 @@ class Core():
     # catch SIGTERM and stop application
     def signal_handler(self, sig, frame):
         self.running = False
+        self.loop.stop()
+
+    # catch SIGCHLD and check our process health inside the loop
+    def child_signal_handler(self, sig, frame):
+        self.loop.call_soon(self.supervisor.child_handler)
 
     def stop(self):
         try:
@@ -90,10 +142,19 @@ class Core():
             self.midi.stop()
             self.osc.stop()
             self.jackd.stop()
+            self.xtest.close()
+            self.metrics.stop()
+            self.telemetry.stop()
+            self.procwatch.stop()
+            self.sched.stop()
+            if self.updates is not None:
+                self.updates.stop()
+            if self.inotify is not None:
+                self.inotify.close()
             # auto save config?
             #...
-            # delete our data tmp file
-            os.remove('/var/tmp/opendsp-run-data')
+            # delete our state snapshot and menus
+            self.state.clear()
         except Exception as e:
             logging.error("error stoping opendsp: {message}"
                           .format(message=e))
@@ -108,13 +169,27 @@ class Core():
         logging.info('Loading config files')
         self.load_config()
 
+        logging.info('Starting scheduler helper')
+        self.sched.start()
+
+        # file system events, for updates and catalog
+        try:
+            self.inotify = inotify.Inotify()
+            self.loop.add_reader(self.inotify.fd, self.inotify.handle)
+        except OSError as e:
+            logging.warning("inotify not avaliable: {message}".format(message=e))
+
+        logging.info('Starting update worker')
+        self.updates = update.UpdateWorker(self)
+        self.updates.start()
+
         # interfaces
         logging.info('Initing Jackd Interface')
         audio_config = self.config['system']['audio']
         # app requests different audio setup? merge setup
         if 'audio' in self.config['mod']:
             audio_config.update(self.config['mod']['audio'])
-        self.jackd = JackdInterface(self, audio_config)
+        self.jackd = JackdInterface(self, dict(audio_config))
         self.jackd.start()
 
         logging.info('Initing OSC Interface')
@@ -144,8 +219,8 @@ class Core():
         self.machine_setup()
 
         # do we need to unload rcu and organize irq threads for full tickless kernel support?
-        if 'cpu' in self.config['system']['system'] and 'realtime' in self.config['system']['system']:
-            self.set_tickless(self.config['system']['system']['cpu'])
+        if 'irq' in self.config['system'] or ('cpu' in self.config['system']['system'] and 'realtime' in self.config['system']['system']):
+            self.set_tickless()
 
         # setup running state
         self.running = True
@@ -153,20 +228,26 @@ class Core():
         # load mod
         self.load_mod(self.config['system']['mod']['name'])
 
+        # realtime and tickless support check, driven by process events
+        if 'realtime' in self.config['system']['system']:
+            self.procwatch.start()
+
+        # periodic work, each one with its own interval
+        # connections are driven by jack graph events, this is only a safety net
+        self.loop.add_timer(5, self.connection_handler)
+        # update packages are driven by inotify, timer only when it is not avaliable
+        if not self.watch_updates():
+            self.loop.add_timer(60, self.updates.check)
+        # dsp load sampling and metrics file
+        self.metrics.start()
+        # per app cpu, memory and context switches
+        self.telemetry.start()
+
         logging.info('OpenDSP up and running!')
 
-        while self.running:
-            # realtime and tickless support check
-            if 'realtime' in self.config['system']['system']:
-                self.rt_handle()
-            # interface handlers
-            self.midi.handle()
-            # health check for audio, midi and video subsystem
-            self.health_check()
-            # check for update packages
-            self.check_updates()
-            # rest for a while....
-            time.sleep(5)
+        # sleep until something happens
+        if self.running:
+            self.loop.run()
 
         # not running any more? call stop to handle all running process
         self.stop()
@@ -188,19 +269,26 @@ class Core():
     def load_mod(self, name):
         """Load a Mod
         get data from mod cfg
-        delete and stop a running mod
+        stop a running mod, apps shared with the new one keeps running
         checks and handle display needs
         instantiate and start the mod
         """
+        # jackd on its way back? latest mod request loads once it is up
+        if self.audio_pending is not None:
+            self.audio_pending = (self.load_mod, (name,))
+            return
+        # running mod is stopped along with the new one start, so
+        # the apps they share keeps running
+        previous = self.mod
+        self.mod = None
+        # xruns from now until the mod apps are ready are tagged as mod load
+        self.begin_mod_load()
         try:
-            # stop and destroy mod instance in case
-            if self.mod != None:
-                self.mod.stop()
-                del self.mod
-                self.mod = None
-
             # load module config
             if self.load_config_mod(name) is not True:
+                if previous is not None:
+                    previous.stop()
+                self.mod_loaded()
                 return
 
             # any audio config changes?
@@ -221,8 +309,14 @@ class Core():
             # save system config updates
             self.save_system()
             if reload_subsystem:
-                # force a restart opendsp system
-                self.restart()
+                # apps are jack clients, nothing to share with new mod
+                if previous is not None:
+                    previous.stop()
+                    previous = None
+                config = dict(current_audio_config)
+                config.update(check_audio_config)
+                # mod loads once jackd is back with the new config
+                self.restart_audio(config, self.load_mod, name)
                 return
 
             # inteligent display managment to save our beloved resources
@@ -232,13 +326,121 @@ class Core():
             self.mod = mod.Mod(name, self.config['mod'], self.config['ecosystem'], self)
 
             # get mod application ecosystem up and running
-            self.mod.start()
+            self.mod.start(previous)
+
+            # update our state snapshot, menus and subscribers
+            self.notify('mod', {'name': name})
 
-            # update our running data file
-            self.update_run_data()
+            # deferred update packages waiting for an idle mod?
+            self.updates.check()
         except Exception as e:
             logging.exception("error loading mod {name}: {message}"
                               .format(name=name, message=str(e)))
+            if previous is not None and previous.running:
+                previous.stop()
+            self.mod_loaded()
+
+    def begin_mod_load(self):
+        # audio restart continuation calls us again, keep the same tag open
+        if self.mod_loading is None:
+            self.metrics.begin('mod_load')
+        else:
+            self.mod_loading.cancel()
+        self.mod_loading = self.loop.call_later(MOD_LOAD_TIMEOUT, self.mod_loaded)
+
+    def mod_loaded(self, mod=None):
+        """Mod Loaded
+        ends the mod_load tag, called by the mod once its last app is
+        ready, on load errors or on timeout. a mod other than the
+        current one is a stopped one, nothing to do
+        """
+        if mod is not None and mod is not self.mod:
+            return
+        if self.mod_loading is None:
+            return
+        self.mod_loading.cancel()
+        self.mod_loading = None
+        self.metrics.end('mod_load')
+
+    def restart_audio(self, config=None, callback=None, *args):
+        """Restart Audio
+        restarts only jackd, jack dependent interfaces get reattached.
+        returns at once, callback is called from core loop when done
+        """
+        if self.audio_pending is None:
+            self.metrics.begin('audio_restart')
+        self.audio_pending = (callback, args)
+        self.midi.stop()
+        self.jackd.restart(config, self.audio_restarted)
+
+    def audio_restarted(self):
+        self.midi.start()
+        self.metrics.end('audio_restart')
+        callback, args = self.audio_pending
+        self.audio_pending = None
+        if callback is not None:
+            callback(*args)
+
+    def recover_audio(self):
+        """Recover Audio
+        jackd crashed, restart audio subsystem and reload the mod
+        """
+        if self.mod is not None:
+            name = self.mod.name
+            self.mod.stop()
+            self.mod = None
+        else:
+            name = self.config['system']['mod'].get('name')
+        if name:
+            self.restart_audio(None, self.load_mod, name)
+        else:
+            self.restart_audio()
+
+    def load_mod_by_idx(self, idx, bank=0):
+        # index resolved at execution time, against the catalog
+        name = self.catalog.get_mod(idx, bank)
+        if name is not None:
+            self.load_mod(name)
+
+    def load_mod_by_name(self, name):
+        if name in self.catalog.get_mods():
+            self.load_mod(name)
+        else:
+            logging.error("mod {name} not found".format(name=name))
+
+    def load_project_by_name(self, project):
+        if self.mod is not None and project in self.mod.get_projects():
+            self.mod.load_project(project)
+        else:
+            logging.error("project {project} not found".format(project=project))
+
+    def load_project_by_idx(self, idx, bank=0):
+        if self.mod is not None:
+            project = self.mod.get_project_by_idx(idx, bank)
+            if project is not None:
+                self.mod.load_project(project)
+
+    def queue_project_by_idx(self, idx, bank=0):
+        # next project for main app warm standby
+        if self.mod is not None:
+            project = self.mod.get_project_by_idx(idx, bank)
+            if project is not None:
+                self.mod.queue_project(project)
+
+    def set_force_display(self, display=None):
+        """Set Force Display
+        force all process into display, None for mod.cfg choices. restarts opendsp
+        when it changes
+        """
+        if display == self.config['system']['system'].get('force_display'):
+            return
+        if display is None:
+            del self.config['system']['system']['force_display']
+        else:
+            self.config['system']['system']['force_display'] = display
+        self.save_system()
+        # as a restart command, drops pending mod and project loads
+        self.commands.submit('restart', self.restart)
 
     def save_system(self):
         system_file = "{}/system.cfg".format(self.path_data)
@@ -251,7 +453,79 @@ class Core():
             self.config["mod"].write(mod_config)
 
     def health_check(self):
-        pass
+        """Health Check
+        state of audio, midi and video subsystem process
+        """
+        health = {}
+        for name, interface in (('jackd', self.jackd), ('midi', self.midi)):
+            if interface is not None:
+                health.update({"{interface}:{proc}".format(interface=name, proc=proc):
+                               self.supervisor.status(interface.proc[proc], proc)
+                               for proc in interface.proc})
+        if self.mod is not None:
+            health.update(self.mod.check_health())
+        return health
+
+    def is_performing(self, idle=300, busy_load=20):
+        """Is Performing
+        someone on stage: jack transport rolling, dsp load above busy_load
+        or midi control and xruns on the last idle seconds
+        """
+        if self.jackd is not None and self.jackd.is_rolling():
+            return True
+        if (self.metrics.load.last() or 0) > busy_load:
+            return True
+        if self.midi is not None and time.monotonic() - self.midi.last_event < idle:
+            return True
+        return time.time() - self.metrics.get_last_xrun() < idle
+
+    def notify(self, event, data):
+        """Notify
+        state events from core and workers
+        """
+        logging.info("state event {event}: {data}".format(event=event, data=data))
+        if event in ('mod', 'project', 'catalog'):
+            self.state.request()
+        # osc subscribers
+        if self.osc is not None:
+            self.osc.publish(event, data)
+
+    def connection_handler(self):
+        self.connections_scheduled = False
+        # interface handlers
+        self.midi.handle()
+        # handler audio and midi connections from config, all owners at once
+        made = self.jackd.reconcile()
+        if made > 0:
+            self.notify('connection', {'made': made, 'pending': self.jackd.reconciler.count_pending()})
+        # apps waiting for their ports to be ready
+        if self.mod is not None:
+            self.mod.ready_handler()
+
+    def request_connections(self):
+        """Request Connections
+        thread safe, called from jack graph notifications.
+        a small delay coalesce the burst of ports an app register at once
+        """
+        if not self.connections_scheduled:
+            self.connections_scheduled = True
+            self.loop.call_later(0.02, self.connection_handler)
+
+    def watch_updates(self):
+        path_updates = "{path_data}/updates".format(path_data=self.path_data)
+        if self.inotify is None:
+            return False
+        try:
+            self.inotify.add_watch(path_updates,
+                                   inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO,
+                                   self.updates_handler)
+            # anything left there while we were down?
+            self.loop.call_soon(self.updates.check)
+            return True
+        except Exception as e:
+            logging.warning("inotify not avaliable for {path}, using timer instead: {message}"
+                            .format(path=path_updates, message=e))
+            return False
 
     def save_config(self, config):
         pass
@@ -318,62 +592,49 @@ class Core():
             for display in self.config['system']['system']['display'].split(","):
                 display_mod.add(display.strip())
 
-        # some one to stop?
+        # some one to stop? the ones needed get started all at once
         display_run = set([display
-                           for display in self.display
-                           if self.display[display] == True])
+                           for display in self.display.running
+                           if self.display.running[display] == True])
         display_stop = display_run - display_mod
-        for display in self.display:
+        for display in self.display.running:
             if display in display_stop:
                 self.stop_display(display)
             elif display in display_mod and display not in display_run:
                 self.start_display(display)
 
     def stop_display(self, display='native'):
-        if display == 'native':
-            # stop native display service
-            subprocess.call(['sudo', 'systemctl', 'stop', 'display'], shell=False, env=None)
-            self.display['native'] = False
-
-        if display == 'virtual':
-            # stop virtual display service
-            subprocess.call(['sudo', 'systemctl', 'stop', 'vdisplay'], shell=False, env=None)
-            self.display['virtual'] = False
+        self.xtest.close(display)
+        self.display.stop(display)
 
     def start_display(self, display='native'):
-        # native display init
-        if display == 'native':
-            subprocess.call(['sudo', 'systemctl', 'start', 'display'], shell=False, env=None)
-            # wait display to get up...
-            while "X" not in (p.name() for p in psutil.process_iter()):
-                time.sleep(1)
-            try:
-                # avoid screen auto shutoff
-                environment = { "DISPLAY": ":0" }
-                subprocess.call(['xset', 's', 'off'], shell=False, env=environment)
-                subprocess.call(['xset', '-dpms'], shell=False, env=environment)
-                subprocess.call(['xset', 's', 'noblank'], shell=False, env=environment)
-            except:
-                pass
-            self.display['native'] = True
-
-        # virtual display init
-        if display == 'virtual':
-            subprocess.call(['sudo', 'systemctl', 'start', 'vdisplay'], shell=False, env=None)
-            # wait virtual display to get up...
-            while "Xvfb" not in (p.name() for p in psutil.process_iter()):
-                time.sleep(1)
-            self.display['virtual'] = True
+        # non blocking, start_proc waits for the display it needs
+        self.display.start(display)
 
-    def start_proc(self, call, env=None):
-        # yes we need environment vars!
-        environment = os.environ.copy()
+    def window_mapped(self, display, pid):
+        # called from display window watcher
+        if self.mod is not None:
+            self.mod.window_mapped(pid)
 
+    def get_display(self, env=None):
+        """Get Display
+        display a process will run on, None for no display
+        """
         # force all proc request into a specific display
         # overwrite the display option on mod.cfg
         if 'force_display' in self.config['system']['system']:
             if self.config['system']['system']['force_display'] is not None:
                 env = self.config['system']['system']['force_display']
+        if env in ('native', 'virtual'):
+            return env
+        return None
+
+    def start_proc(self, call, env=None):
+        # yes we need environment vars!
+        environment = os.environ.copy()
+
+        # force_display applies here too
+        env = self.get_display(env)
 
         if env is not None:
             # setup common SDL environment
@@ -383,16 +644,15 @@ class Core():
         # native display run env request?
         if env == 'native':
             environment["DISPLAY"] = ":0"
-            # start display service?
-            if self.display['native'] == False:
-                self.start_display('native')
 
         # virtual display run env request?
         if env == 'virtual':
             environment["DISPLAY"] = ":1"
-            # start virtual display service?
-            if self.display['virtual'] == False:
-                self.start_display('virtual')
+
+        # display apps get here via display.when_ready, never block core loop on it
+        if env in ('native', 'virtual') and not self.display.ready[env].is_set():
+            logging.warning("display {env} not ready yet for: {call}".format(env=env, call=" ".join(call)))
+            self.display.start(env)
 
         # starting proc
         logging.info("starting proccess on env: {env} via cmd: {call}".format(env=env,
@@ -400,14 +660,21 @@ class Core():
         return subprocess.Popen(call, env=environment, preexec_fn=os.setsid)
 
     def stop_proc(self, proc):
-        proc.terminate()
+        self.stop_procs({proc.pid: proc})
+
+    def stop_procs(self, procs):
+        """Stop Procs
+        intentional stop of {name: proc}, all of them in parallel
+        with SIGTERM -> SIGKILL deadline, returns {name: seconds}
+        """
+        return self.supervisor.terminate(procs)
 
     def call(self, call, env=False):
         environment = os.environ.copy() if env == True else None
         subprocess.run(call, env=environment, shell=True, check=True)
 
     def set_limits(self, pid, limits):
-        subprocess.call(['sudo', 'prlimit', '--pid', str(pid), limits], shell=False, env=None)
+        self.sched.apply([{'pid': pid, 'limits': sched.parse_limits(limits)}])
 
     def set_cpu(self, rt_process, cpu):
         """
@@ -417,11 +684,9 @@ class Core():
         # only if realtime feature is configured to be used
         if 'cpu' not in self.config['system']['system']:
             return
-        rt_process = rt_process.replace('"', '')
-        if rt_process not in self.rt_proc:
-            self.rt_proc[rt_process] = {}
-            self.rt_proc[rt_process]['list'] = []
+        rt_process = self.rt_process(rt_process)
         self.rt_proc[rt_process]['cpu'] = cpu
+        self.request_rt_scan(rt_process)
 
     def set_realtime(self, rt_process, inc=0):
         """
@@ -431,139 +696,171 @@ class Core():
         # only if configured to be used
         if 'realtime' not in self.config['system']['system']:
             return
-        rt_process = rt_process.replace('"', '')
-        if rt_process not in self.rt_proc:
-            self.rt_proc[rt_process] = {}
-            self.rt_proc[rt_process]['list'] = []
+        rt_process = self.rt_process(rt_process)
         prio = int(self.config['system']['system']['realtime'])+inc
         if prio > 99:
             prio = 99
         self.rt_proc[rt_process]['priority'] = prio
-
-    def rt_handle(self):
+        self.request_rt_scan(rt_process)
+
+    def set_rt_threads(self, rt_process, rt_thread):
+        """Set RT Threads
+        per thread realtime schema, only threads whose name matches
+        get realtime, the rest of the process stays as it is.
+        rt_thread: "pattern[:priority[:cpu]], ..." where priority is
+        relative to the process priority or 'other' for SCHED_OTHER
+        """
+        if not rt_thread:
+            return
+        rt_process = self.rt_process(rt_process)
+        threads = []
+        for rule in rt_thread.replace('"', '').split(","):
+            rule = [data.strip() for data in rule.split(":")]
+            if not rule[0]:
+                continue
+            thread = {'regex': re.compile(rule[0])}
+            if len(rule) > 1 and rule[1]:
+                thread['priority'] = rule[1]
+            if len(rule) > 2 and rule[2]:
+                thread['cpu'] = rule[2]
+            threads.append(thread)
+        self.rt_proc[rt_process]['threads'] = threads
+        self.request_rt_scan(rt_process)
+
+    def rt_process(self, rt_process):
+        # get or create the rt schema entry for a process name pattern
+        rt_process = rt_process.replace('"', '')
+        if rt_process not in self.rt_proc:
+            self.rt_proc[rt_process] = {}
+            self.rt_proc[rt_process]['regex'] = re.compile(rt_process)
+            self.rt_proc[rt_process]['pids'] = set()
+        return rt_process
+
+    def request_rt_scan(self, rt_process):
+        """Request RT Scan
+        schema changed for rt_process, apply it to the already running ones.
+        coalesce the set_cpu + set_realtime calls into a single scan
+        """
+        self.rt_proc[rt_process]['dirty'] = True
+        if not self.rt_scan_scheduled:
+            self.rt_scan_scheduled = True
+            self.loop.call_soon(self.rt_scan)
+
+    def rt_scan(self):
+        self.rt_scan_scheduled = False
+        # realtime schema only applies if watcher is enabled
+        if 'realtime' not in self.config['system']['system']:
+            return
+        batch = []
+        for proc in self.rt_proc:
+            if self.rt_proc[proc].pop('dirty', False):
+                for pid in procwatch.find_pids(self.rt_proc[proc]['regex']):
+                    self.rt_proc[proc]['pids'].add(pid)
+                    batch.extend(self.rt_requests(proc, pid))
+        self.sched.apply(batch)
+
+    def rt_requests(self, proc, pid):
+        # whole process schema or one request per classified thread
+        if 'threads' in self.rt_proc[proc]:
+            requests = [self.rt_thread_request(proc, pid, tid)
+                        for tid in procwatch.list_threads(pid)]
+            return [request for request in requests if request is not None]
+        request = {'pid': pid, 'threads': True}
+        if 'cpu' in self.rt_proc[proc]:
+            # set process cpu afinity
+            request['cpu'] = str(self.rt_proc[proc]['cpu'])
+        if 'priority' in self.rt_proc[proc]:
+            # priority
+            request['priority'] = self.rt_proc[proc]['priority']
+        return [request]
+
+    def rt_thread_request(self, proc, pid, tid):
+        comm = procwatch.read_comm(pid, tid)
+        if comm is None:
+            return None
+        request = {'pid': tid}
+        if 'cpu' in self.rt_proc[proc]:
+            request['cpu'] = str(self.rt_proc[proc]['cpu'])
+        for thread in self.rt_proc[proc]['threads']:
+            if not thread['regex'].search(comm):
+                continue
+            # thread priority is relative to the process one
+            priority = self.rt_proc[proc].get('priority',
+                                              int(self.config['system']['system']['realtime']))
+            if thread.get('priority') == 'other':
+                priority = 0
+            elif 'priority' in thread:
+                priority = min(max(priority + int(thread['priority']), 1), 99)
+            request['priority'] = priority
+            if 'cpu' in thread:
+                request['cpu'] = thread['cpu']
+            return request
+        # not an rt thread, drop any realtime it inherited from its creator
+        request['priority'] = 0
+        return request
+
+    def rt_handle(self, events):
+        """RT Handle
+        process watcher callback, match new process against rt_proc
+        patterns the moment they appear and forget the dead ones
+        """
         try:
-            # read pgrep process and compare those ones already setup from the new ones...
-            for proc in self.rt_proc:
-                # pgrep to find all process and childs to setup realtime
-                pid_list = subprocess.check_output(['pgrep', '-w', proc]).decode()
-                for pid in pid_list.split('\n'):
-                    if len(pid) > 0:
-                        if pid not in self.rt_proc[proc]['list']:
-                            if 'cpu' in self.rt_proc[proc]:
-                                # set process cpu afinity
-                                subprocess.call(['sudo', 'taskset', '-a', '-p', '-c', str(self.rt_proc[proc]['cpu']), str(pid)], shell=False, env=None)
-                            if 'priority' in self.rt_proc[proc]:
-                                # priority
-                                subprocess.call(['sudo', 'chrt', '-a', '-f', '-p', str(self.rt_proc[proc]['priority']), str(pid)], shell=False, env=None)
-                            # add to list of handled pids
-                            self.rt_proc[proc]['list'].append(pid)
+            batch = []
+            for event, pid, tid in events:
+                if event == 'exec':
+                    comm = procwatch.read_comm(pid)
+                    if comm is None:
+                        continue
+                    for proc in self.rt_proc:
+                        if self.rt_proc[proc]['regex'].search(comm):
+                            self.rt_proc[proc]['pids'].add(pid)
+                            batch.extend(self.rt_requests(proc, pid))
+                        else:
+                            # exec into something else? not ours anymore
+                            self.rt_proc[proc]['pids'].discard(pid)
+                elif event in ('thread', 'comm'):
+                    # new or renamed thread of a per thread schema process?
+                    for proc in self.rt_proc:
+                        if 'threads' in self.rt_proc[proc] and pid in self.rt_proc[proc]['pids']:
+                            request = self.rt_thread_request(proc, pid, tid)
+                            if request is not None:
+                                batch.append(request)
+                elif event == 'exit' and pid == tid:
+                    for proc in self.rt_proc:
+                        self.rt_proc[proc]['pids'].discard(pid)
+            # all of them in one shot
+            self.sched.apply(batch)
         except Exception as e:
             logging.error("error handling rt schema: {message}"
                           .format(message=e))
 
     def restart(self):
         self.running = False
+        # nothing else to do
+        self.commands.cancel()
+        self.loop.stop()
         subprocess.call(['sudo', 'systemctl', 'restart', 'opendsp'], shell=False, env=None)
 
-    def set_tickless(self, cpus):
-        # unload rcu from isolated cpus
-        subprocess.call(['bash', '-c', "for i in `pgrep rcu` ; do sudo taskset -apc 0 $i ; done"], shell=False, env=None)
-        # first move all non irq threads to non isoleted core
-        subprocess.call(['bash', '-c', "for i in `pgrep irq` ; do sudo taskset -apc {} $i ; done".format(cpus)], shell=False, env=None)
-        # testing out some ideas, idealy it should be configurable via system.cfg for each system
-        # move snd cards irq threads to opendsp system cpu
-        snd_irq = subprocess.check_output(['pgrep', '-f', 'irq/.*snd']).decode().strip()
-        subprocess.call(['sudo', 'taskset', '-a', '-p', '-c', '1', snd_irq], shell=False, env=None)
-        subprocess.call(['sudo', 'chrt', '-a', '-f', '-p', '99', snd_irq], shell=False, env=None)
-        # USB controllers (for USB audio option)
-        #"irq/16-ehci" p 90
-        #"irq/29-xhci" p 90
-        # Timer (essential for system) p 80
-        #"irq/0-timer"
-        rtc_irq = subprocess.check_output(['pgrep', '-f', 'irq/.*rtc']).decode().strip()
-        subprocess.call(['sudo', 'taskset', '-a', '-p', '-c', '0', rtc_irq], shell=False, env=None)
-        subprocess.call(['sudo', 'chrt', '-a', '-f', '-p', '80', rtc_irq], shell=False, env=None)
-        # ACPI (power management) p 70
-        acpi_irq = subprocess.check_output(['pgrep', '-f', 'irq/.*acpi']).decode().strip()
-        subprocess.call(['sudo', 'taskset', '-a', '-p', '-c', '0', acpi_irq], shell=False, env=None)
-        subprocess.call(['sudo', 'chrt', '-a', '-f', '-p', '70', acpi_irq], shell=False, env=None)
-
-    def machine_setup(self):
-        # set main PCM to max gain volume
-        subprocess.call(['amixer', 'sset', 'PCM,0', '100%'], shell=False, env=None)
-
-    def update_run_data(self):
-        """updates /var/tmp/opendsp-run-data:
-        opendsp_user_data_path
-        mod_name
-        mod_project_path
-        mod_project
-        mod_project_extension
+    def set_tickless(self):
+        """Set Tickless
+        rcu and irq placement planned from system.cfg [irq] rules
         """
-        #, path_data, name_mod, app_name, path_project, name_project):
-        data = []
-        data.append("{path_data}\n"
-                    .format(path_data=self.path_data))
-        data.append("{}\n"
-                    .format(self.config['system']['mod'].get('name', '')))
-        if self.config['mod'] != None:
-            if 'app1' in self.config['mod']:
-                app_name = self.config['mod']['app1'].get('name', '')
-                data.append("{name}\n"
-                            .format(name=app_name))
-                data.append("{project_path}\n"
-                            .format(project_path=self.mod.path_project))
-                data.append("{project}\n"
-                            .format(project=self.config['mod']['app1'].get('project', '')))
-                if app_name in self.config['ecosystem']:
-                    data.append("{project_extension}\n"
-                                .format(project_extension=self.config['ecosystem'][app_name].get('extension', '')))
         try:
-            with open("/var/tmp/opendsp-run-data", "w+") as run_data:
-                run_data.writelines(data)
+            irq.IrqPlanner(self.config['system'], self.sched).apply()
         except Exception as e:
-            logging.error("error trying to update run data: {message}"
+            logging.error("error planning irq schema: {message}"
                           .format(message=e))
 
+    def machine_setup(self):
+        # set main PCM to max gain volume
+        subprocess.call(['amixer', 'sset', 'PCM,0', '100%'], shell=False, env=None)
+
     def mount_fs(self, fs, action):
         if 'write'in action:
             subprocess.call(['sudo', 'mount',  '-o', 'remount,rw', fs], shell=False, env=None)
         elif 'read' in action:
             subprocess.call(['sudo', 'mount',  '-o', 'remount,ro', fs], shell=False, env=None)
 
-    def check_updates(self):
-        """We check updates in 10 subcycles
-        call to avoid disk reads overhead
-        """
-        if self.updates_counter == 10:
-            self.updates_counter = 0
-            update_pkgs = glob.glob("{path_data}/updates/*.pkg.tar.xz"
-                                    .format(path_data=self.path_data))
-            # any update package?
-            for path_package in update_pkgs:
-                # mount filesystem in rw mode
-                self.mount_fs("/", "write")
-                # install package
-                subprocess.call(['/usr/bin/sudo',
-                                 '/sbin/pacman',
-                                 '--noconfirm',
-                                 '-U',
-                                 path_package])
-                # any systemd changes?
-                subprocess.call(['/usr/bin/sudo',
-                                 '/sbin/systemctl',
-                                 'daemon-reload',
-                                 path_package])
-                # mount filesystem in ro mode back again
-                self.mount_fs("/", "read")
-                # remove the package from /updates dir and leave user a note about the update
-                subprocess.call(['/bin/rm', path_package])
-                with open(self.path_data + '/updates/log.txt','a') as log_file:
-                    log_file.write("{date}: package {package} updated successfully"
-                                   .format(date=str(datetime.datetime.now()),
-                                           package=path_package))
-                if 'opendspd' in path_package:
-                    # restart our self
-                    self.restart()
-        else:
-            self.updates_counter += 1
+    def updates_handler(self, path, name, mask):
+        if name.endswith('.pkg.tar.xz'):
+            self.updates.check()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import re
+import socket
+import struct
+import logging
+
+# netlink proc connector definitions from <linux/connector.h> and <linux/cn_proc.h>
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_COMM = 0x00000200
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct('=IHHII')
+CN_MSG = struct.Struct('=IIIIHH')
+PROC_EVENT = struct.Struct('=IIQ')
+PIDS = struct.Struct('=II')
+FORK = struct.Struct('=IIII')
+
+def read_comm(pid, tid=None):
+    path = "/proc/{pid}/comm".format(pid=pid)
+    if tid is not None:
+        path = "/proc/{pid}/task/{tid}/comm".format(pid=pid, tid=tid)
+    try:
+        with open(path) as comm:
+            return comm.read().strip()
+    except OSError:
+        return None
+
+def list_pids():
+    return [int(pid) for pid in os.listdir('/proc') if pid.isdigit()]
+
+def list_threads(pid):
+    try:
+        return [int(tid) for tid in os.listdir("/proc/{pid}/task".format(pid=pid))]
+    except OSError:
+        return []
+
+def open_connector():
+    """Open Connector
+    netlink proc connector socket bound and listening, needs CAP_NET_ADMIN.
+    the kernel checks it against the socket opener, so a privileged
+    process can open it and hand it over to us
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+    try:
+        sock.bind((0, CN_IDX_PROC))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        subscribe(sock, PROC_CN_MCAST_LISTEN)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def subscribe(sock, op):
+    payload = struct.pack('=I', op)
+    cn_msg = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+    header = NLMSGHDR.pack(NLMSGHDR.size + len(cn_msg), NLMSG_DONE, 0, 0, os.getpid())
+    sock.send(header + cn_msg)
+
+def find_pids(pattern):
+    """Find Pids
+    pids of all process whose name matches pattern, pgrep alike
+    """
+    regex = re.compile(pattern)
+    pids = []
+    for pid in list_pids():
+        comm = read_comm(pid)
+        if comm is not None and regex.search(comm):
+            pids.append(pid)
+    return pids
+
+class ProcWatcher():
+    """Process Watcher
+    reports process and thread life cycle events as they happen via
+    netlink proc connector, opened by our privileged scheduler helper
+    (opener) or by ourself when we are root. without it we fallback to
+    scan /proc on a timer.
+
+    callback receives a list of (event, pid, tid) tuples where event
+    is one of 'exec', 'thread', 'comm' or 'exit'
+    """
+
+    def __init__(self, loop, callback, interval=1, opener=None):
+        self.loop = loop
+        self.callback = callback
+        # returns a ready proc connector socket or None
+        self.opener = opener
+        self.interval = interval
+        self.sock = None
+        self.timer = None
+        # /proc scan fallback state: pid -> (comm, set of tids)
+        self.tasks = {}
+
+    def start(self):
+        try:
+            if self.opener is not None:
+                self.sock = self.opener()
+            if self.sock is None:
+                self.sock = open_connector()
+            self.sock.setblocking(False)
+            self.loop.add_reader(self.sock.fileno(), self.handle)
+            logging.info("process watcher using netlink proc connector")
+        except OSError as e:
+            logging.warning("netlink proc connector not avaliable, scanning /proc each {interval}s: {message}"
+                            .format(interval=self.interval, message=e))
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            self.timer = self.loop.add_timer(self.interval, self.scan)
+        # report everything already running
+        self.scan()
+
+    def stop(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            try:
+                subscribe(self.sock, PROC_CN_MCAST_IGNORE)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def handle(self):
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                # ENOBUFS: we lost events, get back in sync via /proc
+                logging.warning("process watcher lost events: {message}".format(message=e))
+                self.scan()
+                break
+            offset = NLMSGHDR.size + CN_MSG.size
+            if len(data) < offset + PROC_EVENT.size:
+                continue
+            what, _, _ = PROC_EVENT.unpack_from(data, offset)
+            offset += PROC_EVENT.size
+            if what == PROC_EVENT_FORK:
+                _, _, child_pid, child_tgid = FORK.unpack_from(data, offset)
+                # new process are reported on exec, we only care about new threads here
+                if child_pid != child_tgid:
+                    events.append(('thread', child_tgid, child_pid))
+            elif what == PROC_EVENT_EXEC:
+                pid, tgid = PIDS.unpack_from(data, offset)
+                events.append(('exec', tgid, pid))
+            elif what == PROC_EVENT_COMM:
+                pid, tgid = PIDS.unpack_from(data, offset)
+                events.append(('comm', tgid, pid))
+            elif what == PROC_EVENT_EXIT:
+                pid, tgid = PIDS.unpack_from(data, offset)
+                events.append(('exit', tgid, pid))
+        if events:
+            self.callback(events)
+
+    def scan(self):
+        """Scan
+        diff /proc against last known state
+        """
+        events = []
+        tasks = {}
+        for pid in list_pids():
+            tids = set(list_threads(pid))
+            comm = read_comm(pid)
+            if not tids or comm is None:
+                continue
+            tasks[pid] = (comm, tids)
+            known_comm, known = self.tasks.get(pid, (None, None))
+            if known is None or known_comm != comm:
+                # new process or exec in place after fork
+                events.append(('exec', pid, pid))
+                known = known if known is not None else {pid}
+            events.extend([('thread', pid, tid) for tid in tids - known])
+            events.extend([('exit', pid, tid) for tid in known - tids if tid != pid])
+        for pid in self.tasks:
+            if pid not in tasks:
+                events.append(('exit', pid, pid))
+        self.tasks = tasks
+        if events:
+            self.callback(events)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import re
+import json
+import logging
+
+import jack
+
+# compiled port patterns cache
+PATTERNS = {}
+
+# learned port names kept for this many app launch keys
+CACHE_SIZE = 64
+
+def compile_pattern(pattern):
+    if pattern not in PATTERNS:
+        # sanitize special chars from port names, user can still regex
+        # port expression on jack clients that randon their port names
+        PATTERNS[pattern] = re.compile(pattern.replace('(', r'\(').replace(')', r'\)'))
+    return PATTERNS[pattern]
+
+class PortCache():
+    """Port Cache
+    concrete port names each app registered on its previous runs,
+    {key: {pattern: port name}} kept on disk. key is the app name,
+    binary version and arguments, see App.get_cache_key()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        try:
+            with open(path) as data:
+                self.data = json.load(data)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, key, pattern):
+        return self.data.get(key, {}).get(pattern)
+
+    def learn(self, key, pattern, name):
+        if key not in self.data:
+            # keep it small, oldest keys goes first
+            while len(self.data) >= CACHE_SIZE:
+                self.data.pop(next(iter(self.data)))
+        if self.data.setdefault(key, {}).get(pattern) != name:
+            self.data[key][pattern] = name
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            # atomic, a power cut never leave us with half a file
+            with open(self.path + '.tmp', 'w') as data:
+                json.dump(self.data, data)
+            os.replace(self.path + '.tmp', self.path)
+            self.dirty = False
+        except OSError as e:
+            logging.error("error saving port cache {path}: {message}"
+                          .format(path=self.path, message=e))
+
+class Snapshot():
+    """Snapshot
+    jack graph as seen at the start of a reconcile pass, port names
+    from one get_ports() call and connections read on demand
+    """
+
+    def __init__(self, client, aliases=None):
+        self.client = client
+        self.aliases = aliases or {}
+        self.ports = [port.name for port in client.get_ports()]
+        self.names = set(self.ports)
+        self.connections = {}
+        self.matches = {}
+        # patterns resolved through a swapped client alias
+        self.aliased = set()
+
+    def get_clients(self):
+        return set([port.split(':', 1)[0] for port in self.ports])
+
+    def match(self, pattern, learned=None):
+        # exact name learned from previous runs, when it is there
+        if learned is not None and learned in self.names and learned.split(':', 1)[0] not in self.aliases:
+            return learned
+        if pattern not in self.matches:
+            self.matches[pattern] = None
+            # client swapped by a standby instance? its old name may
+            # belong to another instance by now, alias goes first
+            for client in self.aliases:
+                if pattern.startswith(client + ':'):
+                    self.matches[pattern] = self.match(self.aliases[client] + pattern[len(client):])
+                    if self.matches[pattern] is not None:
+                        self.aliased.add(pattern)
+                        break
+            # first port matching pattern, same as client.get_ports(pattern)[0]
+            if self.matches[pattern] is None:
+                regex = compile_pattern(pattern)
+                self.matches[pattern] = next((port for port in self.ports if regex.search(port)), None)
+        return self.matches[pattern]
+
+    def get_connections(self, port):
+        if port not in self.connections:
+            self.connections[port] = set([data.name for data in self.client.get_all_connections(port)])
+        return self.connections[port]
+
+    def is_connected(self, origin, dest):
+        return dest in self.get_connections(origin)
+
+class Reconciler():
+    """Reconciler
+    desired state of jack connections. each owner(apps, midi interface)
+    register its desired edges and every pass takes one snapshot of
+    the graph, computes the diff locally and apply it in one batch.
+    edges dropped outside opendsp are made again on next pass
+
+    Usage::
+
+        >>> reconciler = Reconciler(opendsp.jackd)
+        >>> reconciler.set('app1:hydrogen', [{'origin': 'Hydrogen:out_L', 'dest': 'system:playback_1'}])
+        >>> reconciler.reconcile()
+    """
+
+    def __init__(self, jackd):
+        self.jackd = jackd
+        # owner -> desired edges
+        self.desired = {}
+        # owner -> port cache key
+        self.keys = {}
+        # swapped client name -> client name that took its place
+        self.aliases = {}
+        self.cache = PortCache("{path_data}/ports.json".format(path_data=jackd.opendsp.path_data))
+        # owner -> edges not satisfied on last pass
+        self.pending = {}
+        self.snapshot = None
+
+    def set(self, owner, connections, key=None):
+        """Set
+        owner desired edges, key enables learned port names
+        """
+        self.desired[owner] = list(connections)
+        self.pending[owner] = list(connections)
+        self.keys[owner] = key
+
+    def update(self, owner, connections, key=None):
+        """Update
+        new desired edges for owner, the ones no longer wanted are
+        disconnected and the kept ones stay untouched
+        """
+        dropped = [ports for ports in self.desired.get(owner, []) if ports not in connections]
+        self.disconnect(dropped, self.keys.get(owner))
+        self.set(owner, connections, key)
+
+    def get_snapshot(self):
+        return Snapshot(self.jackd.client, self.aliases)
+
+    def swap(self, old, new, owner=None, key=None):
+        """Swap
+        moves every desired edge from client old to client new, the
+        new edges are made before the old ones are dropped. owner port
+        cache key moves to key, the one of the process behind new
+        """
+        rename = lambda port: new + port[len(old):] if port.startswith(old + ':') else port
+        snapshot = self.get_snapshot()
+        moves = {}
+        for owner in self.desired:
+            for origin, dest, ports in self.resolve(snapshot, self.desired[owner], self.keys[owner]):
+                if origin is None or dest is None:
+                    continue
+                edge = (rename(origin), rename(dest))
+                if edge != (origin, dest) and edge[0] in snapshot.names and edge[1] in snapshot.names:
+                    moves[(origin, dest)] = edge
+        try:
+            for origin, dest in moves.values():
+                if not snapshot.is_connected(origin, dest):
+                    self.jackd.client.connect(origin, dest)
+            for origin, dest in moves:
+                if snapshot.is_connected(origin, dest):
+                    self.jackd.client.disconnect(origin, dest)
+        except jack.JackError as e:
+            logging.error("error swapping client {old} to {new}: {message}"
+                          .format(old=old, new=new, message=e))
+        # patterns written for old client name now resolves to new one
+        self.aliases = {client: self.aliases[client] for client in self.aliases
+                        if self.aliases[client] != old and client != new}
+        if old != new:
+            self.aliases[old] = new
+        if owner in self.keys:
+            self.keys[owner] = key
+        return len(moves)
+
+    def remove(self, owner, disconnect=True):
+        if disconnect:
+            self.disconnect(self.desired.get(owner, []), self.keys.get(owner))
+        self.desired.pop(owner, None)
+        self.pending.pop(owner, None)
+        self.keys.pop(owner, None)
+
+    def reset(self, owner):
+        """Reset
+        disconnect owner edges, they are made again on next pass
+        """
+        self.disconnect(self.desired.get(owner, []), self.keys.get(owner))
+        self.pending[owner] = list(self.desired.get(owner, []))
+
+    def disconnect(self, connections, key=None):
+        if not connections or self.jackd.client is None:
+            return
+        try:
+            snapshot = self.get_snapshot()
+            for origin, dest, ports in self.resolve(snapshot, connections, key):
+                if origin is not None and dest is not None and snapshot.is_connected(origin, dest):
+                    self.jackd.client.disconnect(origin, dest)
+                    # same edge wanted twice
+                    snapshot.get_connections(origin).discard(dest)
+        except jack.JackError as e:
+            logging.error("error on reset disconnection: {message}"
+                          .format(message=e))
+
+    def resolve(self, snapshot, connections, key=None):
+        resolved = []
+        for ports in connections:
+            # origin is always the owner own port, see Mod.gen_conn()
+            pattern = ports['origin']
+            if key is None:
+                origin = snapshot.match(pattern)
+            else:
+                origin = snapshot.match(pattern, self.cache.get(key, pattern))
+                # learn only names found straight on a client of our own,
+                # aliased or swapped out client names may be another instance next run
+                if origin is not None and self.is_learnable(snapshot, pattern, origin):
+                    self.cache.learn(key, pattern, origin)
+            resolved.append((origin, snapshot.match(ports['dest']), ports))
+        return resolved
+
+    def is_learnable(self, snapshot, pattern, name):
+        client = name.split(':', 1)[0]
+        return (pattern not in snapshot.aliased
+                and client not in self.aliases
+                and client not in self.aliases.values())
+
+    def reconcile(self):
+        """Reconcile
+        returns the number of connections made
+        """
+        if self.jackd.client is None:
+            return 0
+        snapshot = self.get_snapshot()
+        self.snapshot = snapshot
+        batch = {}
+        for owner in self.desired:
+            pending = []
+            for origin, dest, ports in self.resolve(snapshot, self.desired[owner], self.keys[owner]):
+                if origin is None or dest is None:
+                    # waiting for a end to show up
+                    pending.append(ports)
+                elif not snapshot.is_connected(origin, dest):
+                    # same edge from different owners goes once
+                    batch.setdefault((origin, dest), (owner, ports))
+            self.pending[owner] = pending
+        # apply diff
+        made = 0
+        for (origin, dest), (owner, ports) in batch.items():
+            try:
+                self.jackd.client.connect(origin, dest)
+                made += 1
+                logging.info("connect handler found: {port_origin} {port_dest}"
+                             .format(port_origin=origin, port_dest=dest))
+            except jack.JackError as e:
+                self.pending[owner].append(ports)
+                logging.error("error on auto connection: {message}"
+                              .format(message=e))
+        self.cache.save()
+        return made
+
+    def count_pending(self):
+        return sum([len(pending) for pending in self.pending.values()])
+
+    def has_port(self, pattern):
+        # against last pass snapshot
+        if self.snapshot is None:
+            self.snapshot = self.get_snapshot()
+        return self.snapshot.match(pattern) is not None
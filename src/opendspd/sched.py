@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import json
+import array
+import socket
+import resource
+import threading
+import subprocess
+import logging
+
+from . import procwatch
+
+# prlimit command line names to resource limits
+LIMITS = {
+    'as': 'RLIMIT_AS',
+    'core': 'RLIMIT_CORE',
+    'cpu': 'RLIMIT_CPU',
+    'data': 'RLIMIT_DATA',
+    'fsize': 'RLIMIT_FSIZE',
+    'locks': 'RLIMIT_LOCKS',
+    'memlock': 'RLIMIT_MEMLOCK',
+    'msgqueue': 'RLIMIT_MSGQUEUE',
+    'nice': 'RLIMIT_NICE',
+    'nofile': 'RLIMIT_NOFILE',
+    'nproc': 'RLIMIT_NPROC',
+    'rss': 'RLIMIT_RSS',
+    'rtprio': 'RLIMIT_RTPRIO',
+    'rttime': 'RLIMIT_RTTIME',
+    'sigpending': 'RLIMIT_SIGPENDING',
+    'stack': 'RLIMIT_STACK',
+}
+
+# root owned helper entry point, the only thing our sudoers rule allows
+HELPER = '/usr/bin/opendspd-sched'
+
+def parse_cpus(cpus):
+    """Parse CPUs
+    taskset -c style list "0,2-3" into a set of cpu ids
+    """
+    cpu_set = set()
+    for cpu in str(cpus).split(","):
+        cpu = cpu.strip()
+        if not cpu:
+            continue
+        if '-' in cpu:
+            first, last = cpu.split('-', 1)
+            cpu_set.update(range(int(first), int(last)+1))
+        else:
+            cpu_set.add(int(cpu))
+    return cpu_set
+
+def parse_limits(limits):
+    """Parse Limits
+    prlimit command line style "--memlock=65536 --nofile=1024:4096"
+    into {'memlock': [soft, hard]}, 'unlimited' is kept as is
+    """
+    parsed = {}
+    for limit in limits.split():
+        name, _, value = limit.lstrip('-').partition('=')
+        if name not in LIMITS or not value:
+            logging.error("unknown resource limit request: {limit}".format(limit=limit))
+            continue
+        soft, _, hard = value.partition(':')
+        parsed[name] = [soft, hard if hard else soft]
+    return parsed
+
+def get_threads(pid):
+    try:
+        return [int(tid) for tid in os.listdir("/proc/{pid}/task".format(pid=pid))]
+    except OSError:
+        return [int(pid)]
+
+def apply_request(request):
+    """Apply Request
+    runs inside the privileged helper, one request per pid:
+        {'pid': 123, 'threads': True, 'cpu': '1', 'priority': 90, 'limits': {...}}
+    priority 0 means SCHED_OTHER. hardware irq affinity requests:
+        {'irq': 31, 'cpu': '1'}
+    """
+    if 'irq' in request:
+        with open("/proc/irq/{irq}/smp_affinity_list".format(irq=int(request['irq'])), 'w') as affinity:
+            affinity.write(",".join(str(cpu) for cpu in sorted(parse_cpus(request['cpu']))))
+        return
+    pid = int(request['pid'])
+    tids = get_threads(pid) if request.get('threads', False) else [pid]
+    if 'cpu' in request:
+        cpu_set = parse_cpus(request['cpu'])
+        for tid in tids:
+            os.sched_setaffinity(tid, cpu_set)
+    if 'priority' in request:
+        priority = min(int(request['priority']), 99)
+        if priority > 0:
+            policy = os.SCHED_FIFO
+        else:
+            policy, priority = os.SCHED_OTHER, 0
+        for tid in tids:
+            os.sched_setscheduler(tid, policy, os.sched_param(priority))
+    for name, (soft, hard) in request.get('limits', {}).items():
+        soft = resource.RLIM_INFINITY if soft == 'unlimited' else int(soft)
+        hard = resource.RLIM_INFINITY if hard == 'unlimited' else int(hard)
+        resource.prlimit(pid, getattr(resource, LIMITS[name]), (soft, hard))
+
+def apply_batch(batch):
+    results = []
+    for request in batch:
+        result = {'pid': request.get('pid', request.get('irq'))}
+        try:
+            apply_request(request)
+            result['ok'] = True
+        except Exception as e:
+            result['ok'] = False
+            result['error'] = str(e)
+        results.append(result)
+    return results
+
+class Scheduler():
+    """Scheduler
+    client side of our long lived privileged helper, it applies
+    cpu affinity, realtime priority and resource limits via direct
+    syscalls in batches instead of one sudo process per pid
+
+    Usage::
+
+        >>> sched = Scheduler()
+        >>> sched.start()
+        >>> sched.apply([{'pid': 123, 'threads': True, 'cpu': '1', 'priority': 90}])
+        [{'pid': 123, 'ok': True}]
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # our end and helper end of the local socket
+        self.sock, helper = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            call = [HELPER]
+            # no need to sudo if we are root already
+            if os.geteuid() != 0:
+                call = ['sudo', '-n'] + call
+            self.proc = subprocess.Popen(call, stdin=helper, stdout=helper, close_fds=True)
+            # helper own it now, its exit gives us EOF
+            helper.close()
+            self.reader = self.sock.makefile('r')
+            # empty batch round trip, sudo fails right away without the rule
+            self.sock.settimeout(5)
+            self.sock.sendall(b"[]\n")
+            if not self.reader.readline():
+                raise OSError("helper exited, is /etc/sudoers.d/opendspd installed?")
+            self.sock.settimeout(None)
+            logging.info("scheduler helper running as pid {pid}".format(pid=self.proc.pid))
+        except Exception as e:
+            logging.error("error starting scheduler helper {helper}, applying in-process, realtime "
+                          "setup limited to our own capabilities: {message}".format(helper=HELPER, message=e))
+            self.sock.close()
+            self.sock = None
+        finally:
+            helper.close()
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            self.proc = None
+
+    def apply(self, batch):
+        """Apply
+        send a batch of requests and wait for per pid results
+        """
+        if len(batch) == 0:
+            return []
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    self.sock.sendall((json.dumps(batch) + "\n").encode())
+                    line = self.reader.readline()
+                    if line:
+                        results = json.loads(line)
+                        self.log_results(results)
+                        return results
+                except Exception as e:
+                    logging.error("error on scheduler helper: {message}".format(message=e))
+                logging.error("scheduler helper is gone, applying in-process")
+                self.sock.close()
+                self.sock = None
+            # no helper? try it our self, works if we have the capabilities
+            results = apply_batch(batch)
+            self.log_results(results)
+            return results
+
+    def open_proc_connector(self):
+        """Open Proc Connector
+        netlink proc connector socket opened by the helper, so only the
+        helper needs CAP_NET_ADMIN and not every app we launch. None when
+        there is no helper or it can not open it
+        """
+        with self.lock:
+            if self.sock is None:
+                return None
+            try:
+                self.sock.sendall((json.dumps({'open': 'proc_connector'}) + "\n").encode())
+                data, fds = b"", []
+                size = socket.CMSG_SPACE(array.array('i').itemsize)
+                while not data.endswith(b"\n"):
+                    chunk, ancdata, _, _ = self.sock.recvmsg(4096, size)
+                    if not chunk:
+                        raise OSError("scheduler helper is gone")
+                    data += chunk
+                    for level, kind, fd_data in ancdata:
+                        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                            fds.extend(array.array('i', fd_data))
+                result = json.loads(data)[0]
+            except (OSError, ValueError) as e:
+                logging.error("error on scheduler helper: {message}".format(message=e))
+                return None
+            if not result['ok'] or not fds:
+                logging.warning("scheduler helper unable to open proc connector: {message}"
+                                .format(message=result.get('error')))
+                return None
+            return socket.socket(fileno=fds[0])
+
+    def log_results(self, results):
+        for result in results:
+            if not result['ok']:
+                logging.error("error setting scheduler for pid {pid}: {message}"
+                              .format(pid=result['pid'], message=result['error']))
+
+def open_proc_connector():
+    try:
+        sock = procwatch.open_connector()
+    except OSError as e:
+        return [{'pid': None, 'ok': False, 'error': str(e)}], None
+    return [{'pid': None, 'ok': True}], sock
+
+def main():
+    """Helper main
+    reads one json batch per line from stdin socket, writes the results back.
+    {'open': 'proc_connector'} gets the socket back as SCM_RIGHTS
+    """
+    channel = socket.socket(fileno=0)
+    reader = channel.makefile('r')
+    for line in reader:
+        sock = None
+        try:
+            request = json.loads(line)
+            if isinstance(request, dict) and request.get('open') == 'proc_connector':
+                results, sock = open_proc_connector()
+            else:
+                results = apply_batch(request)
+        except ValueError as e:
+            results = [{'pid': None, 'ok': False, 'error': str(e)}]
+        data = (json.dumps(results) + "\n").encode()
+        if sock is None:
+            channel.sendall(data)
+            continue
+        channel.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [sock.fileno()]))])
+        # kernel has it on our client side now
+        sock.close()
+
+if __name__ == '__main__':
+    main()
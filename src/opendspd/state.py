@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import time
+import json
+import shlex
+import shutil
+import logging
+from xml.sax.saxutils import quoteattr
+
+# state.json schema version, bump it on incompatible changes
+VERSION = 1
+
+PATH_STATE = "/var/tmp/opendsp"
+
+def write_atomic(path, data):
+    # readers never see half a file
+    with open(path + '.tmp', 'w') as output:
+        output.write(data)
+    os.replace(path + '.tmp', path)
+
+def osc_command(path, *args):
+    # explicit ,typespec or send_osc guesses it, names like 01 would go as int
+    types = "," + "".join('i' if isinstance(arg, int) else 'f' if isinstance(arg, float) else 's'
+                          for arg in args)
+    return " ".join(["send_osc", "8000", path, types] + [shlex.quote(str(arg)) for arg in args])
+
+def menu_item(label, command):
+    return ("<item label={label}><action name=\"Execute\"><command>{command}</command></action></item>"
+            .format(label=quoteattr(label), command=command.replace('&', '&amp;').replace('<', '&lt;')))
+
+def menu_separator(label):
+    return "<separator label={label}/>".format(label=quoteattr(label))
+
+class State():
+    """State
+    atomic and versioned state.json snapshot plus ready to `cat`
+    openbox pipe menus, written on mod, project and catalog changes:
+
+        /var/tmp/opendsp/state.json
+        /var/tmp/opendsp/menu-mods.xml
+        /var/tmp/opendsp/menu-projects.xml
+        /var/tmp/opendsp/menu-manage.xml
+
+    menu actions address mods and projects by name
+    """
+
+    def __init__(self, opendsp, path=PATH_STATE):
+        self.opendsp = opendsp
+        self.path = path
+        self.serial = 0
+        self.scheduled = False
+
+    def request(self):
+        """Request
+        coalesce a burst of changes into one write
+        """
+        if not self.scheduled:
+            self.scheduled = True
+            self.opendsp.loop.call_later(0.1, self.write)
+
+    def get_state(self):
+        opendsp = self.opendsp
+        mod = opendsp.mod
+        state = {'version': VERSION,
+                 'serial': self.serial,
+                 'time': time.time(),
+                 'running': opendsp.running,
+                 'path_data': opendsp.path_data,
+                 'mods': opendsp.catalog.get_mods(),
+                 'mod': None}
+        if mod is not None:
+            state['mod'] = {'name': mod.name,
+                            'apps': {app_id: {'name': mod.app[app_id].app.get('name', ''),
+                                              'project': mod.app[app_id].config.get('project', ''),
+                                              'display': mod.app[app_id].get_display()}
+                                     for app_id in mod.app},
+                            'main_app': mod.main_app,
+                            'project': None,
+                            'projects': mod.get_projects()}
+            if mod.main_app in mod.app:
+                state['mod']['project'] = mod.app[mod.main_app].config.get('project', '')
+                state['mod']['path_project'] = mod.path_project
+                state['mod']['extension'] = mod.ext_project
+        return state
+
+    def write(self):
+        self.scheduled = False
+        self.serial += 1
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            state = self.get_state()
+            write_atomic(self.path + '/menu-mods.xml', self.render_mods(state))
+            write_atomic(self.path + '/menu-projects.xml', self.render_projects(state))
+            write_atomic(self.path + '/menu-manage.xml', self.render_manage(state))
+            # state last, its serial tells menus are up to date with it
+            write_atomic(self.path + '/state.json', json.dumps(state, indent=1))
+        except Exception as e:
+            logging.error("error trying to update state: {message}"
+                          .format(message=e))
+
+    def clear(self):
+        # not running anymore, menus falls back to their static version
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def render_mods(self, state):
+        menu = "<openbox_pipe_menu>"
+        menu += menu_separator(state['mod']['name'] if state['mod'] is not None else "No mod loaded")
+        for index, name_mod in enumerate(state['mods']):
+            menu += menu_item("{id}: {name_mod}".format(id=index, name_mod=name_mod),
+                              osc_command('/opendsp/mod/load_name', name_mod))
+        menu += "</openbox_pipe_menu>"
+        return menu
+
+    def render_projects(self, state):
+        menu = "<openbox_pipe_menu>"
+        if state['mod'] is None:
+            menu += menu_separator("No mod loaded")
+        elif state['mod']['project'] is None:
+            menu += menu_separator("No main app")
+        else:
+            menu += menu_separator(state['mod']['name'])
+            for index, project in enumerate(state['mod']['projects']):
+                menu += menu_item("{id}: {project}".format(id=index, project=project),
+                                  osc_command('/opendsp/project/load_name', project))
+        menu += "</openbox_pipe_menu>"
+        return menu
+
+    def render_manage(self, state):
+        menu = "<openbox_pipe_menu>"
+        menu += menu_separator("Manage")
+        # display menu
+        menu += "<menu id=\"opendsp-display\" label=\"Display\">"
+        menu += menu_separator("Force Display")
+        menu += menu_item("Disable", osc_command('/opendsp/display/force_screen', 'off'))
+        menu += menu_item("Native HDMI", osc_command('/opendsp/display/force_screen', 'native'))
+        menu += menu_item("Virtual VNC", osc_command('/opendsp/display/force_screen', 'virtual'))
+        menu += "</menu>"
+        # tools menu
+        menu += "<menu id=\"opendsp-tools\" label=\"Tools\">"
+        menu += menu_separator("Tools")
+        menu += menu_item("Change password", "rxvt -e changepassword")
+        if os.path.exists("/usr/bin/resizesd"):
+            menu += menu_item("Resize SD user data", "sudo rxvt -e sudo /usr/bin/resizesd")
+        menu += "</menu>"
+        # updates menu
+        menu += "<menu id=\"opendsp-updates\" label=\"Updates\">"
+        menu += menu_separator("Updates")
+        menu += menu_item("OpenDSP Daemon", "sudo rxvt -e /usr/bin/opendspd-update")
+        menu += menu_item("VLC Youtube", "sudo rxvt -e /usr/bin/vlc-youtube-update")
+        menu += "</menu>"
+        # we are running: stop, restart
+        menu += menu_item("Stop", "sudo systemctl stop opendsp")
+        menu += menu_item("Restart", "sudo systemctl restart opendsp")
+        menu += "</openbox_pipe_menu>"
+        return menu
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import time
+import select
+import signal
+import logging
+
+# restart policy defaults, overwritten per app on ecosystem.cfg
+POLICY = {
+    # no, on-failure or always
+    'restart': 'on-failure',
+    # first restart delay in seconds, doubles on each consecutive crash
+    'restart_delay': '0.1',
+    'restart_delay_max': '30',
+    # consecutive crashes before giving up
+    'restart_max': '5',
+    # seconds running to consider the process healthy again
+    'restart_reset': '60',
+}
+
+class Supervisor():
+    """Supervisor
+    watches every child process via pidfd(or SIGCHLD when pidfd is not
+    avaliable) and restarts the crashed ones with exponential backoff
+
+    Usage::
+
+        >>> proc = opendsp.start_proc(call)
+        >>> opendsp.supervisor.watch(proc, 'hydrogen', app.restart, app.app)
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        # pid -> watch state
+        self.watched = {}
+        # name -> consecutive crashes and total restarts
+        self.crashes = {}
+        self.restarts = {}
+        # name -> pending restart timer
+        self.pending = {}
+
+    def get_policy(self, config):
+        policy = dict(POLICY)
+        if config is not None:
+            policy.update({option: str(config[option]).strip()
+                           for option in POLICY if option in config})
+        return policy
+
+    def watch(self, proc, name, restart=None, config=None):
+        """Watch
+        restart callback is called from core loop after the backoff delay
+        """
+        data = {'proc': proc,
+                'name': name,
+                'restart': restart,
+                'policy': self.get_policy(config),
+                'start': time.monotonic(),
+                'pidfd': None}
+        try:
+            data['pidfd'] = os.pidfd_open(proc.pid)
+            self.opendsp.loop.add_reader(data['pidfd'], self.exit_handler, proc.pid)
+        except (AttributeError, OSError):
+            # no pidfd support, SIGCHLD will let us know
+            data['pidfd'] = None
+        self.watched[proc.pid] = data
+        self.restarts.setdefault(name, 0)
+        # died before we start watching it?
+        if proc.poll() is not None:
+            self.opendsp.loop.call_soon(self.exit_handler, proc.pid)
+
+    def forget(self, proc):
+        """Forget
+        stop watching a process, call it before any intentional stop
+        """
+        data = self.watched.pop(proc.pid, None)
+        if data is None:
+            return
+        if data['pidfd'] is not None:
+            self.opendsp.loop.remove_reader(data['pidfd'])
+            os.close(data['pidfd'])
+
+    def cancel(self, name):
+        # cancel a pending restart, the owner is going away
+        timer = self.pending.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def child_handler(self):
+        """Child Handler
+        SIGCHLD fallback, only for process without pidfd
+        """
+        for pid in list(self.watched):
+            data = self.watched[pid]
+            if data['pidfd'] is None and data['proc'].poll() is not None:
+                self.exit_handler(pid)
+
+    def exit_handler(self, pid):
+        data = self.watched.get(pid)
+        if data is None:
+            return
+        proc = data['proc']
+        # reap it
+        code = proc.poll()
+        if code is None:
+            return
+        self.forget(proc)
+        name = data['name']
+        policy = data['policy']
+        logging.warning("process {name}({pid}) exited with code {code}"
+                        .format(name=name, pid=pid, code=code))
+        self.opendsp.notify('health', {'name': name, 'pid': pid, 'code': code, 'state': 'exited'})
+        if data['restart'] is None:
+            return
+        if policy['restart'] == 'no' or (policy['restart'] == 'on-failure' and code == 0):
+            return
+        # healthy for a while? start counting from scratch
+        if time.monotonic() - data['start'] > float(policy['restart_reset']):
+            self.crashes[name] = 0
+        self.crashes[name] = self.crashes.get(name, 0) + 1
+        if self.crashes[name] > int(policy['restart_max']):
+            logging.error("process {name} crashed {crashes} times in a row, giving up"
+                          .format(name=name, crashes=self.crashes[name]-1))
+            self.opendsp.notify('health', {'name': name, 'state': 'failed'})
+            return
+        delay = min(float(policy['restart_delay']) * 2 ** (self.crashes[name]-1),
+                    float(policy['restart_delay_max']))
+        logging.info("restarting {name} in {delay:.2f}s".format(name=name, delay=delay))
+        self.pending[name] = self.opendsp.loop.call_later(delay, self.restart, name, data['restart'])
+
+    def restart(self, name, restart):
+        self.pending.pop(name, None)
+        self.restarts[name] = self.restarts.get(name, 0) + 1
+        restart()
+        self.opendsp.notify('health', {'name': name, 'state': 'restarted', 'restarts': self.restarts[name]})
+
+    def terminate(self, procs, timeout=None):
+        """Terminate
+        SIGTERM whole process groups at once, wait them all in parallel
+        on their pidfds until the deadline, SIGKILL what is left and reap them.
+        procs: {name: proc}, returns {name: seconds to stop}
+        """
+        if timeout is None:
+            timeout = float(self.opendsp.config['system']['system'].get('stop_timeout', 3))
+        start = time.monotonic()
+        deadline = start + timeout
+        alive = {}
+        for name, proc in procs.items():
+            if proc is None:
+                continue
+            self.forget(proc)
+            groups = self.get_group(proc)
+            try:
+                pidfd = os.pidfd_open(proc.pid)
+            except (AttributeError, OSError):
+                # no pidfd support or already reaped
+                pidfd = None
+            self.signal(proc, groups, signal.SIGTERM)
+            alive[name] = (proc, groups, pidfd)
+        report = {}
+        killed = False
+        try:
+            while alive:
+                now = time.monotonic()
+                for name in list(alive):
+                    proc, groups, pidfd = alive[name]
+                    if not self.is_alive(proc, groups):
+                        report[name] = now - start
+                        self.close(pidfd)
+                        del alive[name]
+                if not alive:
+                    break
+                if now > deadline and not killed:
+                    for name, (proc, groups, pidfd) in alive.items():
+                        logging.warning("process {name} did not stop in {timeout}s, killing it"
+                                        .format(name=name, timeout=timeout))
+                        self.signal(proc, groups, signal.SIGKILL)
+                    killed = True
+                    deadline += 1
+                    continue
+                elif now > deadline:
+                    logging.error("unable to stop process: {names}".format(names=", ".join(alive)))
+                    break
+                # running leaders wake us up on exit, group leftovers and
+                # process without pidfd are checked every 10ms
+                pidfds = [pidfd for proc, groups, pidfd in alive.values()
+                          if pidfd is not None and proc.returncode is None]
+                wait = deadline - now
+                if len(pidfds) < len(alive):
+                    wait = min(wait, 0.01)
+                select.select(pidfds, [], [], max(wait, 0))
+        finally:
+            for proc, groups, pidfd in alive.values():
+                self.close(pidfd)
+        for name in report:
+            logging.info("process {name} stopped in {time:.3f}s".format(name=name, time=report[name]))
+        return report
+
+    def close(self, pidfd):
+        if pidfd is not None:
+            os.close(pidfd)
+
+    def get_group(self, proc):
+        # start_proc runs each child on its own session, pgid == pid
+        try:
+            return os.getpgid(proc.pid) == proc.pid
+        except OSError:
+            return False
+
+    def signal(self, proc, groups, sig):
+        try:
+            if groups:
+                os.killpg(proc.pid, sig)
+            else:
+                proc.send_signal(sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def is_alive(self, proc, groups):
+        # reap the leader and check for any group member left behind
+        if proc.poll() is None:
+            return True
+        if not groups:
+            return False
+        try:
+            os.killpg(proc.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # someone there, just not ours to signal
+            pass
+        return True
+
+    def status(self, proc, name):
+        return {'running': proc is not None and proc.poll() is None,
+                'pid': proc.pid if proc is not None else None,
+                'restarts': self.restarts.get(name, 0)}
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import time
+
+from .metrics import Ring
+
+# samples kept per app series, 10 minutes at 2 seconds interval
+HISTORY = 300
+
+# series we keep per app
+SERIES = ('cpu', 'rss', 'majflt', 'nivcsw', 'run', 'wait', 'migrations')
+
+# /proc/<pid>/sched fields, only on kernels with CONFIG_SCHED_DEBUG
+SCHED = ('sum_exec_runtime', 'wait_sum', 'nr_migrations')
+SCHED_DEBUG = os.path.exists('/proc/self/sched')
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def read_stat(path):
+    # fields after comm, comm may have spaces and parens on it
+    with open(path) as stat:
+        return stat.read().rsplit(')', 1)[1].split()
+
+def read_sched(path):
+    """Read Sched
+    {field: value} of SCHED fields, times in ms. older kernels prefix
+    them with se. or se.statistics., wait_sum needs schedstats enabled
+    """
+    sched = {}
+    with open(path) as data:
+        for line in data:
+            name, sep, value = line.partition(':')
+            name = name.strip().rsplit('.', 1)[-1]
+            if sep and name in SCHED:
+                sched[name] = float(value)
+    return sched
+
+def read_schedstat(path):
+    # run and wait time in ns, CONFIG_SCHED_INFO
+    with open(path) as data:
+        run, wait = data.read().split()[:2]
+    return int(run), int(wait)
+
+def read_nivcsw(path):
+    with open(path) as status:
+        for line in status:
+            if line.startswith('nonvoluntary_ctxt_switches:'):
+                return int(line.split()[1])
+    return 0
+
+class Telemetry():
+    """Telemetry
+    per app resource usage straight from procfs, one pass over every
+    supervised process and its threads per interval:
+        /proc/<pid>/stat: cpu time, major faults and rss
+        /proc/<pid>/task/<tid>/status: involuntary context switches
+        /proc/<pid>/task/<tid>/sched: run and wait time, migrations
+    each app keeps cpu%, rss MB, major faults/s, involuntary context
+    switches/s, run% and runqueue wait% summed over threads and cpu
+    migrations/s on bounded ring buffers. sched ones stay at 0 without
+    CONFIG_SCHED_DEBUG, wait falls back to schedstat without schedstats
+
+    Usage::
+
+        >>> opendsp.telemetry.get_summary('app1:hydrogen')
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        # name -> {'pid', 'time', 'counters': last read, 'series': {series: Ring}}
+        self.apps = {}
+        self.timer = None
+
+    def start(self):
+        config = self.opendsp.config['system']['telemetry'] if 'telemetry' in self.opendsp.config['system'] else {}
+        interval = float(config.get('interval', 2))
+        # 0 disables it
+        if interval > 0:
+            self.timer = self.opendsp.loop.add_timer(interval, self.sample)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def sample(self):
+        now = time.monotonic()
+        names = set()
+        for pid, data in list(self.opendsp.supervisor.watched.items()):
+            try:
+                counters = self.read(pid)
+            except (OSError, IndexError, ValueError):
+                # gone in between, supervisor takes care of it
+                continue
+            names.add(data['name'])
+            self.account(data['name'], pid, now, counters)
+        # apps no longer running
+        for name in [name for name in self.apps if name not in names]:
+            del self.apps[name]
+
+    def read(self, pid):
+        stat = read_stat("/proc/{pid}/stat".format(pid=pid))
+        counters = {'ticks': int(stat[11]) + int(stat[12]),
+                    'majflt': int(stat[9]),
+                    'threads': int(stat[17]),
+                    'rss': int(stat[21]) * PAGE_SIZE,
+                    'nivcsw': 0}
+        if SCHED_DEBUG:
+            counters.update({'run': 0.0, 'wait': 0.0, 'migrations': 0})
+        for tid in os.listdir("/proc/{pid}/task".format(pid=pid)):
+            path = "/proc/{pid}/task/{tid}/".format(pid=pid, tid=tid)
+            try:
+                counters['nivcsw'] += read_nivcsw(path + "status")
+                if SCHED_DEBUG:
+                    self.read_thread_sched(path, counters)
+            except (OSError, ValueError):
+                # thread gone while we walk
+                pass
+        return counters
+
+    def read_thread_sched(self, path, counters):
+        sched = read_sched(path + "sched")
+        counters['run'] += sched.get('sum_exec_runtime', 0)
+        counters['migrations'] += int(sched.get('nr_migrations', 0))
+        if 'wait_sum' in sched:
+            counters['wait'] += sched['wait_sum']
+        else:
+            counters['wait'] += read_schedstat(path + "schedstat")[1] / 1000000
+
+    def account(self, name, pid, now, counters):
+        app = self.apps.get(name)
+        # first sample or restarted, nothing to diff against
+        if app is None or app['pid'] != pid:
+            self.apps[name] = {'pid': pid, 'time': now, 'counters': counters,
+                               'series': {series: Ring(HISTORY) for series in SERIES}}
+            return
+        elapsed = now - app['time']
+        if elapsed <= 0:
+            return
+        last = app['counters']
+        series = app['series']
+        series['cpu'].append((counters['ticks'] - last['ticks']) / CLK_TCK / elapsed * 100)
+        series['rss'].append(counters['rss'] / 1048576)
+        series['majflt'].append((counters['majflt'] - last['majflt']) / elapsed)
+        # threads come and go, their switches go with them
+        series['nivcsw'].append(max(counters['nivcsw'] - last['nivcsw'], 0) / elapsed)
+        if 'run' in counters and 'run' in last:
+            # ms per second, as % of one cpu. same for threads going away
+            series['run'].append(max(counters['run'] - last['run'], 0) / elapsed / 10)
+            series['wait'].append(max(counters['wait'] - last['wait'], 0) / elapsed / 10)
+            series['migrations'].append(max(counters['migrations'] - last['migrations'], 0) / elapsed)
+        app['time'] = now
+        app['counters'] = counters
+
+    def get_summary(self, name=None):
+        """Get Summary
+        {name: {'cpu': %, 'cpu_mean': %, 'cpu_max': %, 'rss': MB, ...}}
+        over the whole ring buffers, name limits it to one app
+        """
+        summary = {}
+        for app_name in list(self.apps):
+            if name is not None and app_name != name:
+                continue
+            app = self.apps[app_name]
+            data = {'pid': app['pid'], 'threads': app['counters']['threads']}
+            for series in SERIES:
+                values = app['series'][series].values()
+                data[series] = round(values[-1], 2) if values else 0
+                data[series + '_mean'] = round(sum(values) / len(values), 2) if values else 0
+                data[series + '_max'] = round(max(values), 2) if values else 0
+            summary[app_name] = data
+        return summary
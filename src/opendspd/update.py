@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Core Daemon
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+# Common system tools
+import os
+import glob
+import queue
+import datetime
+import threading
+import subprocess
+import logging
+
+def set_idle():
+    # runs on child side before exec: lowest cpu class, inherited by sudo and pacman
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        os.nice(19)
+
+class UpdateWorker():
+    """Update Worker
+    installs update packages dropped at <data>/updates in a background
+    thread at idle cpu and io priority, optionally deferred while a mod
+    is performing, rechecked on a timer. results goes back to core as
+    'update' state events
+    """
+
+    def __init__(self, opendsp):
+        self.opendsp = opendsp
+        self.path_updates = "{path_data}/updates".format(path_data=opendsp.path_data)
+        config = opendsp.config['system']['updates'] if 'updates' in opendsp.config['system'] else {}
+        self.defer = str(config.get('defer', 'no')).strip().lower() in ('yes', 'true', 'on', '1')
+        self.idle = float(config.get('idle', 300))
+        self.busy_load = float(config.get('busy_load', 20))
+        self.recheck = float(config.get('recheck', 60))
+        self.timer = None
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,
+                                       daemon=True,
+                                       args=())
+        self.thread.start()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread = None
+
+    def check(self):
+        """Check
+        queue any package found, called from core loop on directory changes
+        and again each recheck seconds while deferred
+        """
+        packages = sorted(glob.glob("{path}/*.pkg.tar.xz".format(path=self.path_updates)))
+        if not packages:
+            return
+        if self.defer and self.opendsp.is_performing(self.idle, self.busy_load):
+            if self.timer is None:
+                logging.info("update packages deferred while performing, next check in {recheck}s"
+                             .format(recheck=self.recheck))
+                self.timer = self.opendsp.loop.call_later(self.recheck, self.deferred)
+            return
+        for path_package in packages:
+            with self.lock:
+                if path_package in self.pending:
+                    continue
+                self.pending.add(path_package)
+            self.queue.put(path_package)
+
+    def deferred(self):
+        self.timer = None
+        self.check()
+
+    def run(self):
+        while True:
+            path_package = self.queue.get()
+            if path_package is None:
+                return
+            with self.opendsp.metrics.activity('update_install'):
+                result = self.install(path_package)
+            with self.lock:
+                self.pending.discard(path_package)
+            # let the core know, from inside its loop
+            self.opendsp.loop.call_soon(self.opendsp.notify, 'update', result)
+            if result['ok'] and 'opendspd' in os.path.basename(path_package):
+                # restart our self
+                self.opendsp.commands.submit('restart', self.opendsp.restart)
+
+    def call(self, call):
+        # idle io class and idle cpu scheduler for the whole install chain
+        return subprocess.call(['/usr/bin/ionice', '-c3'] + call, preexec_fn=set_idle)
+
+    def install(self, path_package):
+        result = {'package': os.path.basename(path_package), 'ok': False}
+        start = datetime.datetime.now()
+        logging.info("installing update package {package}".format(package=path_package))
+        try:
+            # mount filesystem in rw mode
+            self.opendsp.mount_fs("/", "write")
+            try:
+                # install package
+                status = self.call(['/usr/bin/sudo', '/sbin/pacman', '--noconfirm', '-U', path_package])
+                # any systemd changes?
+                self.call(['/usr/bin/sudo', '/sbin/systemctl', 'daemon-reload'])
+            finally:
+                # mount filesystem in ro mode back again
+                self.opendsp.mount_fs("/", "read")
+            result['ok'] = status == 0
+            if result['ok']:
+                # remove the package from /updates dir and leave user a note about the update
+                os.remove(path_package)
+                with open(self.path_updates + '/log.txt', 'a') as log_file:
+                    log_file.write("{date}: package {package} updated successfully\n"
+                                   .format(date=str(datetime.datetime.now()),
+                                           package=path_package))
+            else:
+                result['error'] = "pacman exit status {status}".format(status=status)
+        except Exception as e:
+            result['error'] = str(e)
+            logging.error("error installing update package {package}: {message}"
+                          .format(package=path_package, message=e))
+        result['time'] = (datetime.datetime.now() - start).total_seconds()
+        return result
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP App tests
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+import os
+import types
+
+from opendspd import app
+
+class FakeProc():
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def poll(self):
+        return None
+
+class FakeCore():
+
+    def __init__(self):
+        self.launched = []
+        self.waited = []
+        self.display = types.SimpleNamespace(when_ready=self.when_ready)
+        snapshot = types.SimpleNamespace(get_clients=lambda: set())
+        self.jackd = types.SimpleNamespace(reconciler=types.SimpleNamespace(get_snapshot=lambda: snapshot))
+
+    def when_ready(self, display, callback, *args):
+        self.waited.append(display)
+        callback(*args)
+
+    def get_display(self, env=None):
+        return env if env in ('native', 'virtual') else None
+
+    def start_proc(self, call, env=None):
+        self.launched.append((call, env))
+        # any live pid will do for the memory check
+        return FakeProc(os.getpid())
+
+def make_app(core, display):
+    config = {'display': display, 'project': 'one.h2song', 'standby': 'yes', 'standby_reserve': '0'}
+    instance = app.App(config, {'name': 'hydrogen', 'bin': '/usr/bin/hydrogen', 'project_arg': '-s <prj>'},
+                       [], '/home/opendsp/data', core, 'app1')
+    instance.data = {'proc': FakeProc(os.getpid()), 'display': core.get_display(display)}
+    return instance
+
+def test_standby_launched_on_virtual_display():
+    core = FakeCore()
+    instance = make_app(core, 'native')
+    instance.prepare_standby('two.h2song')
+    assert core.waited == ['virtual']
+    assert len(core.launched) == 1
+    call, env = core.launched[0]
+    assert env == app.STANDBY_DISPLAY == 'virtual'
+    assert call[-1].endswith('/two.h2song')
+    # active instance stays where it is until the swap
+    assert instance.get_display() == 'native'
+
+def test_standby_of_app_without_display():
+    core = FakeCore()
+    instance = make_app(core, None)
+    instance.prepare_standby('two.h2song')
+    assert core.launched[0][1] == 'virtual'
+    assert instance.get_display() is None
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP Telemetry tests
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+import pytest
+
+from opendspd import telemetry
+
+# comm with spaces and parens, majflt 7, utime 250, stime 50, 3 threads, rss 512 pages
+STAT = ("1234 (a) b (c)) S 1 1234 1234 0 -1 4194560 100 0 7 0 250 50 0 0 20 0 3 0 "
+        "12345 1000000 512 18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 17 1 0 0 0 0 0\n")
+
+SCHED = """hydrogen (1234, #threads: 5)
+-------------------------------------------------------------------
+se.exec_start                                :       3221853.423431
+se.sum_exec_runtime                          :          1500.250000
+se.nr_migrations                             :                   12
+nr_switches                                  :                  300
+se.statistics.wait_sum                       :            40.500000
+policy                                       :                    1
+"""
+
+def counters(ticks=0, majflt=0, rss=0, nivcsw=0, threads=1):
+    return {'ticks': ticks, 'majflt': majflt, 'rss': rss, 'nivcsw': nivcsw, 'threads': threads}
+
+def test_read_stat_fields(tmp_path):
+    path = tmp_path / 'stat'
+    path.write_text(STAT)
+    stat = telemetry.read_stat(str(path))
+    assert stat[0] == 'S'
+    assert stat[9] == '7'
+    assert (stat[11], stat[12]) == ('250', '50')
+    assert stat[17] == '3'
+    assert stat[21] == '512'
+
+def test_read_counters(tmp_path, monkeypatch):
+    path = tmp_path / 'stat'
+    path.write_text(STAT)
+    read_stat = telemetry.read_stat
+    monkeypatch.setattr(telemetry, 'read_stat', lambda stat: read_stat(str(path)))
+    monkeypatch.setattr(telemetry, 'read_nivcsw', lambda status: 5)
+    monkeypatch.setattr(telemetry.os, 'listdir', lambda task: ['1234', '1235'])
+    monkeypatch.setattr(telemetry, 'SCHED_DEBUG', False)
+    data = telemetry.Telemetry(None).read(1234)
+    assert data == {'ticks': 300, 'majflt': 7, 'threads': 3,
+                    'rss': 512 * telemetry.PAGE_SIZE, 'nivcsw': 10}
+    # per thread sched data summed up
+    monkeypatch.setattr(telemetry, 'SCHED_DEBUG', True)
+    monkeypatch.setattr(telemetry, 'read_sched', lambda sched: {'sum_exec_runtime': 1.5, 'nr_migrations': 2.0})
+    monkeypatch.setattr(telemetry, 'read_schedstat', lambda schedstat: (1500000, 250000))
+    data = telemetry.Telemetry(None).read(1234)
+    assert (data['run'], data['wait'], data['migrations']) == (3.0, 0.5, 4)
+
+def test_read_sched(tmp_path):
+    path = tmp_path / 'sched'
+    path.write_text(SCHED)
+    assert telemetry.read_sched(str(path)) == {'sum_exec_runtime': 1500.25, 'wait_sum': 40.5,
+                                               'nr_migrations': 12}
+    # newer kernels dropped the se.statistics. prefix
+    path.write_text(SCHED.replace('se.statistics.wait_sum', 'wait_sum'))
+    assert telemetry.read_sched(str(path))['wait_sum'] == 40.5
+
+def test_account_rates():
+    tele = telemetry.Telemetry(None)
+    tele.account('app', 10, 100.0, counters(nivcsw=50))
+    # first sample only sets the baseline
+    assert tele.get_summary()['app']['cpu'] == 0
+    tele.account('app', 10, 102.0, counters(ticks=telemetry.CLK_TCK, majflt=10,
+                                             rss=2 * 1048576, nivcsw=90, threads=4))
+    summary = tele.get_summary('app')['app']
+    # one second of cpu over two seconds
+    assert summary['cpu'] == pytest.approx(50)
+    assert summary['rss'] == pytest.approx(2)
+    assert summary['majflt'] == pytest.approx(5)
+    assert summary['nivcsw'] == pytest.approx(20)
+    assert summary['threads'] == 4
+    # switches of exited threads go away with them, never negative
+    tele.account('app', 10, 104.0, counters(ticks=telemetry.CLK_TCK, majflt=10, nivcsw=30))
+    summary = tele.get_summary('app')['app']
+    assert summary['nivcsw'] == 0
+    assert summary['nivcsw_max'] == pytest.approx(20)
+    assert summary['cpu_mean'] == pytest.approx(25)
+
+def test_account_sched_rates():
+    tele = telemetry.Telemetry(None)
+    tele.account('app', 10, 100.0, dict(counters(), run=1000.0, wait=100.0, migrations=5))
+    tele.account('app', 10, 102.0, dict(counters(), run=1500.0, wait=140.0, migrations=9))
+    summary = tele.get_summary('app')['app']
+    # 500ms running and 40ms waiting over two seconds
+    assert summary['run'] == pytest.approx(25)
+    assert summary['wait'] == pytest.approx(2)
+    assert summary['migrations'] == pytest.approx(2)
+
+def test_account_without_sched():
+    tele = telemetry.Telemetry(None)
+    tele.account('app', 10, 100.0, counters())
+    tele.account('app', 10, 101.0, counters())
+    summary = tele.get_summary('app')['app']
+    assert (summary['run'], summary['wait'], summary['migrations']) == (0, 0, 0)
+
+def test_account_restart_resets():
+    tele = telemetry.Telemetry(None)
+    tele.account('app', 10, 100.0, counters())
+    tele.account('app', 10, 101.0, counters(ticks=telemetry.CLK_TCK))
+    # new pid, nothing to diff against
+    tele.account('app', 11, 102.0, counters(ticks=5))
+    summary = tele.get_summary()['app']
+    assert summary['pid'] == 11
+    assert summary['cpu_max'] == 0
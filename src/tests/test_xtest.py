@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# OpenDSP XTEST Input Interface tests
+# Copyright (C) 2015-2019 Romulo Silva <contact@midilab.co>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the doc/GPL.txt file.
+import types
+
+import pytest
+
+from opendspd.interface import xtest
+
+class FakeConn():
+
+    def __init__(self):
+        self.flushed = 0
+        self.closed = False
+
+    def keysym_to_keycode(self, keysym):
+        return 38
+
+    def keycode_to_keysym(self, keycode, index):
+        return 0x61 if index == 0 else 0x41
+
+    def flush(self):
+        self.flushed += 1
+
+    def close(self):
+        # python-xlib flushes pending requests on close
+        self.flush()
+        self.closed = True
+
+@pytest.fixture
+def interface(monkeypatch):
+    sent = []
+    fallback = []
+    conn = FakeConn()
+    monkeypatch.setattr(xtest, 'xdisplay', object(), raising=False)
+    monkeypatch.setattr(xtest, 'X', types.SimpleNamespace(KeyPress=2, KeyRelease=3, MotionNotify=6,
+                                                         ButtonPress=4, ButtonRelease=5), raising=False)
+    monkeypatch.setattr(xtest, 'XK', types.SimpleNamespace(string_to_keysym=lambda name: 0x61), raising=False)
+    monkeypatch.setattr(xtest, 'xtest', types.SimpleNamespace(fake_input=lambda *args, **kwargs: sent.append(args[1:])),
+                        raising=False)
+    interface = xtest.XTestInterface(None)
+    monkeypatch.setattr(interface, 'get_conn', lambda display: conn)
+    monkeypatch.setattr(interface, 'fallback', lambda display, actions: fallback.extend(actions) or False)
+    return interface, conn, sent, fallback
+
+def test_parse_action_chained():
+    commands = xtest.parse_action("key --clearmodifiers ctrl+s click --repeat 2 1")
+    assert commands == [('key', {}, ['ctrl+s']), ('click', {'--repeat': '2'}, ['1'])]
+
+def test_parse_action_unsupported_option():
+    with pytest.raises(xtest.Unsupported):
+        xtest.parse_action("key --window 12 a")
+    with pytest.raises(xtest.Unsupported):
+        xtest.parse_action("click --delay 10 1")
+
+def test_run_supported(interface):
+    interface, conn, sent, fallback = interface
+    assert interface.run('native', ['key a', 'click 1']) is True
+    assert sent == [(2, 38), (3, 38), (4, 1), (5, 1)]
+    assert conn.flushed == 1
+    assert fallback == []
+
+def test_run_mixed_falls_back_without_injecting(interface):
+    interface, conn, sent, fallback = interface
+    actions = ['key a', 'key --window 12 b', 'click 1']
+    assert interface.run('native', actions) is False
+    # nothing buffered, nothing flushed, whole list replayed by xdotool once
+    assert sent == []
+    assert conn.flushed == 0
+    assert fallback == actions
@@ -0,0 +1,29 @@
+#!/bin/sh
+# manage menu while opendspd is stopped, same items the daemon renders
+cat <<'EOF'
+<openbox_pipe_menu>
+    <separator label="Manage"/>
+    <menu id="opendsp-display" label="Display">
+        <separator label="Force Display"/>
+        <item label="Disable"><action name="Execute"><command>send_osc 8000 /opendsp/display/force_screen off</command></action></item>
+        <item label="Native HDMI"><action name="Execute"><command>send_osc 8000 /opendsp/display/force_screen native</command></action></item>
+        <item label="Virtual VNC"><action name="Execute"><command>send_osc 8000 /opendsp/display/force_screen virtual</command></action></item>
+    </menu>
+    <menu id="opendsp-tools" label="Tools">
+        <separator label="Tools"/>
+        <item label="Change password"><action name="Execute"><command>rxvt -e changepassword</command></action></item>
+EOF
+# only where the image ships it, as the daemon does
+if [ -x /usr/bin/resizesd ]; then
+    echo '        <item label="Resize SD user data"><action name="Execute"><command>sudo rxvt -e sudo /usr/bin/resizesd</command></action></item>'
+fi
+cat <<'EOF'
+    </menu>
+    <menu id="opendsp-updates" label="Updates">
+        <separator label="Updates"/>
+        <item label="OpenDSP Daemon"><action name="Execute"><command>sudo rxvt -e /usr/bin/opendspd-update</command></action></item>
+        <item label="VLC Youtube"><action name="Execute"><command>sudo rxvt -e /usr/bin/vlc-youtube-update</command></action></item>
+    </menu>
+    <item label="Start"><action name="Execute"><command>sudo systemctl start opendsp</command></action></item>
+</openbox_pipe_menu>
+EOF